@@ -0,0 +1,204 @@
+import asyncio
+import contextlib
+import time
+
+import bt
+import protocol
+import reconnect
+import transport
+
+# seconds without incoming data after which the handshake is sent again
+REMINDER_INTERVAL = 2.0
+
+
+class AsyncHubBluetooth:
+    """asyncio counterpart of `bt.HubBluetooth`.
+
+    The socket is non-blocking and driven by the event loop's readiness
+    notifications, so any number of watches can be served from one loop without
+    a thread per watch. Iterating an object of this class with `async for`
+    connects, yields every received `hike.SessionBatch` and reconnects whenever
+    the connection is lost, forever.
+
+    A batch is acknowledged with `protocol.ACKNOWLEDGEMENT` when the consumer asks for the next one,
+    that is after it has processed the batch. If the consumer raises instead,
+    the connection is closed without an acknowledgement and the watch sends the
+    sessions again on the next connection.
+
+    Every yielded batch is tagged with `device`, see `hike.SessionBatch.tag`.
+
+    With a `journal`, the received frames are appended to it before being parsed,
+    and retired once the consumer has processed their batch; frames the parser
+    rejects are moved to its rejected file, see `journal.FrameJournal`.
+
+    Attributes:
+        address: Bluetooth MAC address of the watch, or its address on `transport`
+        port: RFCOMM channel of the watch, or its port on `transport`
+        transport: the `transport.Transport` the watch is reached over, RFCOMM by default
+        device: the identifier of the watch on its transport, see `transport.Transport.device_id`
+        reconnect: the `reconnect.ReconnectScheduler` spacing out the connection attempts
+        connect_limit: optional `asyncio.Semaphore` held during connection attempts,
+                       shared by the watches of one adapter so they do not all page at once
+        journal: optional `journal.FrameJournal` of the received frames
+        connected: whether the connection is currently established
+        sock: the socket of the established connection, None otherwise
+        bytes_received, sessions_received: totals over all connections
+        last_sync: unix time of the last acknowledged batch, None before the first one
+    """
+
+    def __init__(self, address: str = bt.WATCH_BT_MAC, port: int = bt.WATCH_BT_PORT,
+                 transport: transport.Transport = transport.TRANSPORTS['rfcomm'],
+                 connect_limit: asyncio.Semaphore = None, journal=None):
+        self.address = address
+        self.port = port
+        self.transport = transport
+        self.device = transport.device_id(address, port)
+        self.reconnect = reconnect.ReconnectScheduler()
+        self.connect_limit = connect_limit
+        self.journal = journal
+        self.connected = False
+        self.sock = None
+        self.bytes_received = 0
+        self.sessions_received = 0
+        self.last_sync = None
+        self.connected_since = None
+        self.connected_seconds = 0.0  # of the previous connections
+
+    async def connect(self):
+        """Tries to connect to the watch until it succeeds, then sends the handshake.
+
+        Failed attempts are spaced out by `reconnect`, and once one failed, the
+        presence of the watch is checked before each attempt, see `transport.Transport.present`.
+        """
+        loop = asyncio.get_running_loop()
+        while not self.connected:
+            async with self.connect_limit or contextlib.nullcontext():
+                delay = 0.0
+                if self.reconnect.should_check_presence:
+                    present = await loop.run_in_executor(None, self.transport.present, self.address, self.port)
+                    delay = self.reconnect.checked_presence(present)
+
+                if not delay:
+                    self.reconnect.attempted()
+                    sock = self.transport.new_socket()
+                    sock.setblocking(False)
+                    try:
+                        await loop.sock_connect(sock, self.transport.endpoint(self.address, self.port))
+                    except OSError:
+                        sock.close()
+                        delay = self.reconnect.failed()
+            if delay:
+                await asyncio.sleep(delay)
+                continue
+
+            try:
+                await loop.sock_sendall(sock, protocol.HANDSHAKE)
+            except OSError:
+                sock.close()
+                await asyncio.sleep(self.reconnect.failed())
+                continue
+
+            self.reconnect.connected()
+            self.sock = sock
+            self.connected = True
+            self.connected_since = time.monotonic()
+            print(f"Hub: Established Bluetooth connection with Watch {self.device}!")
+
+    async def sessions(self):
+        """Async generator yielding the session batches received over the established connection.
+
+        Returns when the connection is lost. Corrupted frames are reported and
+        dropped without an acknowledgement.
+        """
+        loop = asyncio.get_running_loop()
+        parser = protocol.FrameParser()
+        view = recv = None
+        try:
+            while True:
+                if recv is None:
+                    view = parser.receive_buffer()
+                    recv = asyncio.ensure_future(loop.sock_recv_into(self.sock, view))
+                # not `wait_for`: cancelling a receive that already completed would lose its bytes
+                done, _ = await asyncio.wait((recv,), timeout=REMINDER_INTERVAL)
+                if not done:
+                    # the watch only sends its sessions when asked to
+                    await loop.sock_sendall(self.sock, protocol.HANDSHAKE)
+                    continue
+
+                n = recv.result()
+                view.release()
+                view = recv = None
+                if n == 0:
+                    break
+                parser.received(n)
+                self.bytes_received += n
+
+                frames = parser.frames()
+                if not frames:
+                    continue
+                seqs = [self.journal.append(self.device, f) for f in frames] if self.journal else ()
+                try:
+                    sessions = protocol.parse_frames(frames)
+                except (AssertionError, ValueError) as e:
+                    print(e)
+                    print("WARNING: Receiver -> Message was corrupted. Aborting...")
+                    if self.journal:
+                        self.journal.reject(seqs)
+                    continue
+
+                sessions.tag(self.device)
+                try:
+                    yield sessions
+                finally:
+                    # committed, or not acknowledged so the watch keeps the sessions
+                    if self.journal:
+                        self.journal.retire(seqs)
+                await loop.sock_sendall(self.sock, protocol.ACKNOWLEDGEMENT)
+                self.sessions_received += len(sessions)
+                self.last_sync = time.time()
+
+        except OSError as e:
+            print(e)
+        finally:
+            if recv is not None:
+                recv.cancel()
+            print(f"Lost connection with the watch {self.device}.")
+            self.close()
+
+    async def stream(self):
+        """Async generator yielding the session batches of every connection, reconnecting forever."""
+        while True:
+            await self.connect()
+            async for sessions in self.sessions():
+                yield sessions
+
+    def __aiter__(self):
+        return self.stream()
+
+    def stats(self) -> dict:
+        """Returns the transfer statistics of the watch.
+
+        `throughput_bps` is the average number of received bytes per second of connection.
+        """
+        seconds = self.connected_seconds
+        if self.connected_since is not None:
+            seconds += time.monotonic() - self.connected_since
+        return {
+            "connected": self.connected,
+            "bytes_received": self.bytes_received,
+            "sessions_received": self.sessions_received,
+            "connected_s": round(seconds, 1),
+            "throughput_bps": round(self.bytes_received / seconds, 1) if seconds else 0.0,
+            "last_sync": self.last_sync,
+            "reconnect": self.reconnect.stats(),
+        }
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.reconnect.disconnected()
+        if self.connected_since is not None:
+            self.connected_seconds += time.monotonic() - self.connected_since
+        self.sock = None
+        self.connected = False
+        self.connected_since = None
@@ -0,0 +1,189 @@
+"""Static assets of the web interface, and compression of its responses.
+
+The stylesheets and scripts of the pages live in `ASSETS_DIR` and are served
+under a name carrying a hash of their content, such as `home.3f2a9c1e.css`, so
+browsers may keep them for a year: a changed file gets a new name, which the
+pages then link to. Every asset is compressed once at startup, as hard as gzip
+and brotli go, and each request gets the smallest variant it accepts.
+
+Other responses of a compressible type are compressed as they are sent,
+streamed ones included, see `compress_response`.
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+import zlib
+
+from flask import Response
+
+try:
+    import brotli
+except ImportError:
+    # optional, responses are then gzip-compressed only
+    brotli = None
+
+# directory of the stylesheets and scripts, next to this file
+ASSETS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+# URL prefix of the assets, see `AssetStore.url`
+ASSETS_URL = '/assets/'
+# seconds browsers keep an asset, its name changes with its content
+ASSETS_MAX_AGE = 365 * 24 * 3600
+# responses smaller than this many bytes are sent as they are
+COMPRESS_MIN_SIZE = 512
+# compression levels of the responses compressed on the fly; the assets get the highest
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+# mimetypes worth compressing, the others are images or already compressed
+COMPRESSIBLE_MIMETYPES = (
+    'text/html', 'text/css', 'text/csv', 'text/plain',
+    'application/javascript', 'text/javascript', 'application/json', 'application/x-ndjson',
+)
+
+
+def encodings() -> tuple[str, ...]:
+    """Returns the supported content codings, most compact first."""
+    return ('br', 'gzip') if brotli else ('gzip',)
+
+
+def negotiate(request) -> str:
+    """Returns the most compact content coding the client of `request` accepts, or 'identity'."""
+    for encoding in encodings():
+        if request.accept_encodings[encoding]:
+            return encoding
+    return 'identity'
+
+
+def compress(data: bytes, encoding: str, best: bool = False) -> bytes:
+    """Compresses `data` with the content coding `encoding`, as hard as possible if `best`."""
+    if encoding == 'br':
+        return brotli.compress(data, quality=11 if best else BROTLI_QUALITY)
+    # mtime=0 keeps the output the same from one run to the next
+    return gzip.compress(data, compresslevel=9 if best else GZIP_LEVEL, mtime=0)
+
+
+def compress_stream(chunks, encoding: str):
+    """Generator compressing the chunks of a streamed body as they come.
+
+    Output is only yielded once the compressor has a block ready, not after every
+    chunk, which would cost the ratio of streams made of many small chunks.
+    """
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        write, finish = compressor.process, compressor.finish
+    else:
+        # wbits=31 writes a gzip header and trailer around the deflate stream
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+        write, finish = compressor.compress, compressor.flush
+    try:
+        for chunk in chunks:
+            data = write(chunk.encode() if isinstance(chunk, str) else chunk)
+            if data:
+                yield data
+        yield finish()
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+
+class Precompressed:
+    """A response body along with its compressed variants, compressed once and sent many times.
+
+    Attributes:
+        etag: hash of the uncompressed body
+        variants: the body by content coding, 'identity' included; a coding
+                  not saving anything over the body is left out
+    """
+
+    def __init__(self, data: bytes, best: bool = False):
+        self.etag = hashlib.blake2b(data, digest_size=8).hexdigest()
+        self.variants = {'identity': data}
+        if len(data) >= COMPRESS_MIN_SIZE:
+            for encoding in encodings():
+                compressed = compress(data, encoding, best)
+                if len(compressed) < len(data):
+                    self.variants[encoding] = compressed
+
+    def respond(self, request, mimetype: str) -> Response:
+        """Returns the variant the client of `request` accepts, tagged with `etag`; not conditional yet."""
+        encoding = next((e for e in encodings() if e in self.variants and request.accept_encodings[e]), 'identity')
+        response = Response(self.variants[encoding], mimetype=mimetype)
+        if encoding != 'identity':
+            response.headers['Content-Encoding'] = encoding
+        # the variants share their ETag, which is therefore weak, see `compress_response`
+        response.set_etag(self.etag, weak=encoding != 'identity')
+        response.vary.add('Accept-Encoding')
+        return response
+
+
+class AssetStore:
+    """The files of `ASSETS_DIR`, loaded and compressed at startup and served under hashed names.
+
+    Attributes:
+        assets: the `Precompressed` files by hashed name
+        names: hashed names of the files by file name
+    """
+
+    def __init__(self, path: str = ASSETS_DIR):
+        self.assets = {}
+        self.names = {}
+        for name in sorted(os.listdir(path)):
+            with open(os.path.join(path, name), 'rb') as f:
+                asset = Precompressed(f.read(), best=True)
+            stem, ext = os.path.splitext(name)
+            hashed_name = f"{stem}.{asset.etag}{ext}"
+            self.assets[hashed_name] = asset
+            self.names[name] = hashed_name
+
+    def url(self, name: str) -> str:
+        """Returns the URL of the file `name` of `ASSETS_DIR`, to link from a page."""
+        return ASSETS_URL + self.names[name]
+
+    def respond(self, hashed_name: str, request) -> Response:
+        """Returns the response to a request of `url()`, or None if there is no such asset.
+
+        A client may keep the asset for `ASSETS_MAX_AGE` without revalidating it.
+        """
+        asset = self.assets.get(hashed_name)
+        if asset is None:
+            return None
+        mimetype = mimetypes.guess_type(hashed_name)[0] or 'application/octet-stream'
+        response = asset.respond(request, mimetype)
+        response.headers['Cache-Control'] = f'public, max-age={ASSETS_MAX_AGE}, immutable'
+        return response.make_conditional(request)
+
+
+def compress_response(response: Response, request) -> Response:
+    """Compresses a response of a compressible type for a client accepting it, to run after every request.
+
+    Left alone are the responses with no body to compress, streamed files, event
+    streams, whose events must reach the client as they are sent, and the
+    responses already negotiated, such as those of `Precompressed`. A streamed
+    body is compressed chunk by chunk, without buffering it.
+
+    A compressed response is a different representation of the same resource, so
+    its ETag is made weak: `If-None-Match` compares ETags weakly, so a client
+    revalidating its compressed copy still gets a `304 Not Modified`.
+    """
+    if (response.status_code != 200 or response.direct_passthrough
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES
+            or 'Content-Encoding' in response.headers or 'Accept-Encoding' in response.vary):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = negotiate(request)
+    if encoding == 'identity':
+        return response
+
+    if response.is_streamed:
+        response.response = compress_stream(response.response, encoding)
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < COMPRESS_MIN_SIZE:
+            return response
+        response.set_data(compress(data, encoding))
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
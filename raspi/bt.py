@@ -1,9 +1,13 @@
 from sys import exception
 
 import bluetooth
+import socket
 import time
 
 import hike
+import protocol
+import reconnect
+import transport
 
 WATCH_BT_MAC = '08:3A:F2:69:AB:CE'
 WATCH_BT_PORT = 1
@@ -15,33 +19,59 @@ class HubBluetooth:
         connected: A boolean indicating if the connection is currently established with the Watch.
         sock: the socket object created with bluetooth.BluetoothSocket(),
               through which the Bluetooth communication is handled.
+        transport: the `transport.Transport` to reach the Watch over instead of PyBluez, if any.
+        address, port: where the Watch is reached, `WATCH_BT_MAC` and `WATCH_BT_PORT` by default.
+        reconnect: the `reconnect.ReconnectScheduler` spacing out the connection attempts.
+        journal: the `journal.FrameJournal` every received frame is written to before parsing, if any.
     """
 
     connected = False
     sock = None
-    
+    journal = None
+
+    def __init__(self, transport=None, address: str = WATCH_BT_MAC, port: int = WATCH_BT_PORT):
+        self.transport = transport
+        self.address = address
+        self.port = port
+        self.reconnect = reconnect.ReconnectScheduler()
+
     def wait_for_connection(self):
-        """Synchronous function continuously trying to connect to the Watch by 2 sec intervals.
-        If a connection has been made, it sends the watch a `c` ASCII character as a confirmation.
+        """Synchronous function continuously trying to connect to the Watch, at intervals growing
+        while it is away, see `reconnect.ReconnectScheduler`. Once an attempt failed, the presence of
+        the Watch is checked before each attempt, see `transport.Transport.present`.
+        If a connection has been made, it sends the watch `protocol.HANDSHAKE` as a confirmation:
+        an offer of the binary protocol v2 followed by the `c` ASCII character. Firmware without
+        v2 support ignores the offer and keeps sending text frames, which are still understood.
         """
 
         if not self.connected:
-            # try to connect every sec while connection is made
+            presence = self.transport or transport.TRANSPORTS['rfcomm']
             while True:
                 print("Waiting for connection...")
+                if self.reconnect.should_check_presence:
+                    delay = self.reconnect.checked_presence(presence.present(self.address, self.port))
+                    if delay:
+                        time.sleep(delay)
+                        continue
                 try:
-                    self.sock = bluetooth.BluetoothSocket(bluetooth.RFCOMM)
-                    self.sock.connect((WATCH_BT_MAC, WATCH_BT_PORT))
+                    self.reconnect.attempted()
+                    if self.transport is not None:
+                        self.sock = self.transport.connect(self.address, self.port)
+                    else:
+                        self.sock = bluetooth.BluetoothSocket(bluetooth.RFCOMM)
+                        self.sock.connect((self.address, self.port))
                     self.sock.settimeout(2)
                     self.connected = True
-                    self.sock.send('c')
+                    self.sock.send(protocol.HANDSHAKE)
+                    self.reconnect.connected()
                     print("Connected to Watch!")
                     break
-                except bluetooth.btcommon.BluetoothError:
-                    time.sleep(1)
+                except (bluetooth.btcommon.BluetoothError, OSError):
+                    time.sleep(self.reconnect.failed())
                 except Exception as e:
                     print(e)
                     print("Hub: Error occured while trying to connect to the Watch.")
+                    time.sleep(self.reconnect.failed())
 
             print("Hub: Established Bluetooth connection with Watch!")
         print("WARNING Hub: the has already connected via Bluetooth.")
@@ -49,16 +79,16 @@ class HubBluetooth:
     def synchronize(self, callback):
         """Continuously tries to receive data from an established connection with the Watch.
 
-        If receives data, then transforms it to a list of `hike.HikeSession` object.
+        If receives data, then writes its frames to `journal` and transforms them to a `hike.SessionBatch`.
         After that, calls the `callback` function with the transformed data.
         Finally sends a `r` as a response to the Watch for successfully processing the
-        incoming data.
+        incoming data, followed by the handshake asking for the next sessions, see `protocol.ACKNOWLEDGEMENT`.
 
-        If does not receive data, then it tries to send `c` as a confirmation of the established
+        If does not receive data, then it tries to send the `c` handshake as a confirmation of the established
         connection at every second to inform the Watch that the Hub is able to receive sessions.
 
         Args:
-            callback: One parameter function able to accept a list[hike.HikeSession].
+            callback: One parameter function able to accept a hike.SessionBatch.
                       Used to process incoming sessions arbitrarly
 
         Raises:
@@ -69,61 +99,91 @@ class HubBluetooth:
             self.wait_for_connection()
 
         print("Synchronizing with watch...")
-        remainder = b''
+        parser = protocol.FrameParser()
         while True:
             try:
-                chunk = self.sock.recv(1024)
-
-                messages = chunk.split(b'\n')
-                messages[0] = remainder + messages[0]
-                remainder = messages.pop()
+                if parser.recv_from(self.sock) == 0:
+                    # only the sockets of a `transport.Transport` report a closed connection this way
+                    print("Lost connection with the watch.")
+                    self.connected = False
+                    self.reconnect.disconnected()
+                    self.sock.close()
+                    break
+                messages = parser.frames()
 
                 if len(messages):
+                    device = self.transport.device_id(self.address, self.port) if self.transport else self.address
+                    seqs = [self.journal.append(device, m) for m in messages] if self.journal else ()
                     try:
-                        print(f"received messages: {messages}")
+                        print(f"received {len(messages)} messages, {sum(map(len, messages))} bytes")
 
                         sessions = HubBluetooth.messages_to_sessions(messages)
-                        callback(sessions)
-                        self.sock.send('r')
-
-                        print(f"Saved. 'r' sent to the socket!")
-
                     except (AssertionError, ValueError) as e:
                         print(e)
                         print("WARNING: Receiver -> Message was corrupted. Aborting...")
+                        if self.journal:
+                            self.journal.reject(seqs)
+                        continue
+
+                    sessions.tag(device)
+                    try:
+                        callback(sessions)
+                    finally:
+                        # committed, or not acknowledged so the watch keeps the sessions
+                        if self.journal:
+                            self.journal.retire(seqs)
+                    self.sock.send(protocol.ACKNOWLEDGEMENT)
+
+                    print(f"Saved. 'r' sent to the socket!")
 
             except KeyboardInterrupt:
                 self.sock.close()
                 raise KeyboardInterrupt("Shutting down the receiver.")
 
+            except socket.timeout:
+                self.sock.send(protocol.HANDSHAKE)
+                print("Reminder has been sent to the Watch about the attempt of the synchronization.")
+
             except bluetooth.btcommon.BluetoothError as bt_err:
                 print(bt_err)
                 if bt_err.errno == 11: # connection down
                     print("Lost connection with the watch.")
                     self.connected = False
+                    self.reconnect.disconnected()
                     self.sock.close()
                     break
                 elif bt_err.errno == None: # possibly occured by socket.settimeout
-                    self.sock.send('c')
+                    self.sock.send(protocol.HANDSHAKE)
                     print("Reminder has been sent to the Watch about the attempt of the synchronization.")
 
+            except OSError as e:
+                print(e)
+                print("Lost connection with the watch.")
+                self.connected = False
+                self.reconnect.disconnected()
+                self.sock.close()
+                break
+
             except Exception as e:
                 print(e)
 
     @staticmethod
-    def messages_to_sessions(messages: list[bytes]) -> list[hike.HikeSession]:
-        """Transforms multiple incoming messages to a list of hike.HikeSession objects.
+    def messages_to_sessions(messages: list[bytes]) -> hike.SessionBatch:
+        """Transforms multiple incoming messages to a batch of hiking sessions.
 
         Args:
             messages: list of bytes, in the form of the simple protocol between
                       the Hub and the Watch.
 
         Returns:
-            list[hike.HikeSession]: a list of hike.HikeSession objects representing the
-                                    interpreted messages.
+            hike.SessionBatch: the sessions representing the interpreted messages.
+
+        Raises:
+            AssertionError: if a message misses information, or if it is badly formatted.
+            ValueError: if a number of a message cannot be parsed, or is out of range.
         """
 
-        return list(map(HubBluetooth.mtos, messages))
+        return protocol.parse_frames(messages)
 
     @staticmethod
     def mtos(message: bytes) -> hike.HikeSession:
@@ -144,23 +204,4 @@ class HubBluetooth:
         Raises:
             AssertionError: if the message misses information, or if it is badly formatted.
         """
-        m = message.decode('utf-8')
-
-        # filtering because we might have a semi-column at the end of the message, right before the new-line character
-        parts = list(filter(lambda p: len(p) > 0, m.split(';')))
-        assert len(parts) >= 3, f"MessageProcessingError -> The incoming message doesn't contain enough information: {m}"
-
-        hs = hike.HikeSession()
-        hs.id     = int(parts[0])
-        hs.steps  = int(parts[1])
-        hs.km     = float(parts[2])
-
-        def cvt_coord(c):
-            sc = c.split(',')
-            assert len(sc) == 2, f"MessageProcessingError -> Unable to process coordinate: {c}"
-            return float(sc[0]), float(sc[1])
-
-        if len(parts) > 3:
-            hs.coords = map(cvt_coord, parts[3:])
-
-        return hs
+        return protocol.parse_frames([message])[0]
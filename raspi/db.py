@@ -1,9 +1,31 @@
+import bisect
+import json
+import os
 import sqlite3
+import threading
+import time
+import weakref
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager
 
 import hike
-import threading
 
 DB_FILE_NAME = 'sessions.db'
+# suffix of the database holding the archived sessions, attached to every connection as `archive`
+DB_ARCHIVE_SUFFIX = '_archive.db'
+
+# how long a connection waits on a database locked by another process before giving up
+DB_BUSY_TIMEOUT_MS = 5000
+
+# default number of sessions returned by a page query
+DB_PAGE_SIZE = 50
+# number of rows fetched at once by the session iterator
+DB_FETCH_SIZE = 256
+
+# number of single sessions and of session pages kept in memory
+DB_SESSION_CACHE_SIZE = 1024
+DB_PAGE_CACHE_SIZE = 64
 
 DB_SESSION_TABLE = {
     "name": "sessions",
@@ -12,12 +34,319 @@ DB_SESSION_TABLE = {
         "km float",
         "steps integer",
         "burnt_kcal integer",
+        "recorded_at integer",
+        "device text",
+        # the ID the watch sent the session under, and `hike.content_hash` of what it sent
+        "watch_id integer",
+        "content_hash integer",
+    ]
+}
+
+# running totals of the sessions per period, kept up to date by every write
+DB_ROLLUP_TABLE = {
+    "name": "rollups",
+    "cols": [
+        "granularity text",
+        "period text",
+        "sessions integer",
+        "km float",
+        "steps integer",
+        "kcal integer",
+        "PRIMARY KEY (granularity, period)",
     ]
 }
 
+# SQL expression of the period a session falls into, per rollup granularity.
+# Weeks are keyed by the date of their Monday.
+ROLLUP_PERIODS = {
+    "day": "date(recorded_at, 'unixepoch', 'localtime')",
+    "week": "date(recorded_at, 'unixepoch', 'localtime', 'weekday 0', '-6 days')",
+    "all": "'all'",
+}
+
+# GPS track of a session: the coordinates packed by `hike.pack_coords` as native doubles.
+# In the archive the points are zlib compressed.
+DB_TRACK_TABLE = {
+    "name": "tracks",
+    "cols": [
+        "session_id integer PRIMARY KEY",
+        "points blob NOT NULL",
+    ]
+}
+
+# single row counting the writes that changed the sessions, and the unix time of the last one,
+# see `HubDatabase.last_change`
+DB_VERSION_TABLE = {
+    "name": "version",
+    "cols": [
+        "id integer PRIMARY KEY CHECK (id = 0)",
+        "version integer NOT NULL",
+        "changed_at float NOT NULL DEFAULT 0",
+    ]
+}
+
+# the fields of a session as returned by the getters, in the order of `hike.SessionBatch.rows`
+SESSION_FIELDS = ("session_id", "km", "steps", "burnt_kcal", "recorded_at", "device")
+
+# the live and the archived sessions, both ordered by session ID
+ALL_SESSIONS = (f"(SELECT * FROM main.{DB_SESSION_TABLE['name']} "
+                f"UNION ALL SELECT * FROM archive.{DB_SESSION_TABLE['name']})")
+
+# zlib level of the archived tracks
+ARCHIVE_COMPRESSION_LEVEL = 9
+
+
+class WaitStats:
+    """Accumulates the number, total and worst duration of a kind of wait.
+
+    Attributes:
+        count: number of recorded waits
+        total: sum of the recorded waits in seconds
+        max: longest recorded wait in seconds
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self._lock:
+            self.count += 1
+            self.total += seconds
+            self.max = max(self.max, seconds)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "count": self.count,
+                "total_ms": round(self.total * 1000, 3),
+                "avg_ms": round(self.total * 1000 / self.count, 3) if self.count else 0.0,
+                "max_ms": round(self.max * 1000, 3),
+            }
+
+
+class LRUCache:
+    """Thread-safe bounded mapping evicting the least recently used entry when full.
+
+    A reader filling the cache from the database reads `generation` before its
+    query and passes it to `put`: if a writer invalidated entries in between,
+    the value may predate the write and is not stored.
+
+    Attributes:
+        maxsize: maximum number of entries
+        hits: number of `get` calls that found their key
+        misses: number of `get` calls that did not
+        generation: number of invalidations so far
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.generation = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Returns the value cached under `key`, or None."""
+        with self._lock:
+            try:
+                self._entries.move_to_end(key)
+            except KeyError:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return self._entries[key]
+
+    def put(self, key, value, generation: int = None):
+        """Stores `value` under `key`, unless entries were invalidated since `generation` was read."""
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self.generation += 1
+            self._entries.pop(key, None)
+
+    def invalidate_if(self, predicate):
+        """Removes every entry for which `predicate(key, value)` is true."""
+        with self._lock:
+            self.generation += 1
+            for key in [k for k, v in self._entries.items() if predicate(k, v)]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {"size": len(self._entries), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses}
+
+
+class _ThreadConnection:
+    """Holds the connection of a thread in its thread-local data, which is dropped once the thread ends."""
+    __slots__ = ('con', '__weakref__')
+
+    def __init__(self, con: sqlite3.Connection):
+        self.con = con
+
+
+class ConnectionManager:
+    """Hands out one sqlite3 connection per thread on a WAL journaled database.
+
+    With write-ahead logging readers never block the writer and the writer never
+    blocks readers, so every thread can read through its own connection without
+    any locking. Writes are serialized by `write_lock` inside this process, and by
+    SQLite's busy handler between processes.
+
+    A connection is closed once its thread has ended, so a server starting a
+    thread per request does not pile up connections and file descriptors.
+
+    Attributes:
+        path: the database file
+        attached: paths of further databases attached to every connection, by schema name
+        write_lock: serializes write transactions of this process
+        last_write: `time.monotonic()` of the end of the last write of this process
+        lock_wait: time spent waiting on `write_lock`
+        busy_wait: time spent waiting for SQLite to grant the write lock
+        read_time: time spent executing read queries
+    """
+
+    def __init__(self, path: str = DB_FILE_NAME, attached: dict = None, busy_timeout_ms: int = DB_BUSY_TIMEOUT_MS):
+        self.path = path
+        self.attached = attached or {}
+        self.busy_timeout_ms = busy_timeout_ms
+        self.write_lock = threading.Lock()
+        self.last_write = 0.0
+        self.lock_wait = WaitStats()
+        self.busy_wait = WaitStats()
+        self.read_time = WaitStats()
+
+        self._local = threading.local()
+        # open connections by id of their `_ThreadConnection`, only until their thread ends
+        self._connections = {}
+        self._connections_lock = threading.Lock()
+
+    def connection(self) -> sqlite3.Connection:
+        """Returns the connection of the calling thread, opening it on first use."""
+        holder = getattr(self._local, 'holder', None)
+        if holder is None:
+            # autocommit mode: transactions are started explicitly in `writing()`
+            con = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+            con.execute(f"PRAGMA busy_timeout = {self.busy_timeout_ms}")
+            for name, path in self.attached.items():
+                con.execute(f"ATTACH DATABASE ? AS {name}", (path,))
+
+            for schema in ('main', *self.attached):
+                # only takes effect on a new database, see `HubDatabase.compact()` for existing ones
+                con.execute(f"PRAGMA {schema}.auto_vacuum = INCREMENTAL")
+                con.execute(f"PRAGMA {schema}.journal_mode = WAL")
+                con.execute(f"PRAGMA {schema}.synchronous = NORMAL")
+            holder = self._local.holder = _ThreadConnection(con)
+            with self._connections_lock:
+                self._connections[id(holder)] = con
+            weakref.finalize(holder, self._release, id(holder))
+        return holder.con
+
+    def _release(self, key: int):
+        """Closes the connection of a thread that ended."""
+        with self._connections_lock:
+            con = self._connections.pop(key, None)
+        if con is not None:
+            con.close()
+
+    @contextmanager
+    def reading(self):
+        """Context manager yielding a cursor on the calling thread's connection for reads."""
+        cur = self.connection().cursor()
+        start = time.perf_counter()
+        try:
+            yield cur
+        finally:
+            self.read_time.record(time.perf_counter() - start)
+            cur.close()
+
+    @contextmanager
+    def writing(self, durable: bool = False):
+        """Context manager yielding a cursor inside a write transaction.
+
+        The transaction is committed when the block exits normally and rolled back
+        if it raises.
+
+        Args:
+            durable: flush the commit to storage before returning. By default a
+                     commit survives a crash of the process but not of the system.
+        """
+        start = time.perf_counter()
+        self.write_lock.acquire()
+        self.lock_wait.record(time.perf_counter() - start)
+
+        try:
+            cur = self.connection().cursor()
+            if durable:
+                cur.execute("PRAGMA main.synchronous = FULL")
+            start = time.perf_counter()
+            cur.execute("BEGIN IMMEDIATE")
+            self.busy_wait.record(time.perf_counter() - start)
+
+            try:
+                yield cur
+                cur.execute("COMMIT")
+            except BaseException:
+                cur.execute("ROLLBACK")
+                raise
+            finally:
+                if durable:
+                    cur.execute("PRAGMA main.synchronous = NORMAL")
+                cur.close()
+        finally:
+            self.last_write = time.monotonic()
+            self.write_lock.release()
+
+    @contextmanager
+    def maintaining(self):
+        """Context manager yielding a cursor outside of any transaction, holding `write_lock`.
+
+        For statements that cannot run inside a transaction, such as VACUUM.
+        """
+        with self.write_lock:
+            cur = self.connection().cursor()
+            try:
+                yield cur
+            finally:
+                cur.close()
+                self.last_write = time.monotonic()
+
+    def idle_for(self) -> float:
+        """Returns the seconds since the last write of this process, 0 while a write is running."""
+        if self.write_lock.locked():
+            return 0.0
+        return time.monotonic() - self.last_write
+
+    def stats(self) -> dict:
+        """Returns a snapshot of the wait time statistics."""
+        return {
+            "lock_wait": self.lock_wait.snapshot(),
+            "busy_wait": self.busy_wait.snapshot(),
+            "read_time": self.read_time.snapshot(),
+        }
+
+    def close(self):
+        """Closes the connections of all threads."""
+        with self._connections_lock:
+            for con in self._connections.values():
+                con.close()
+            self._connections.clear()
 
-# lock object so multithreaded use of the same
-# HubDatabase object 
 
 class HubDatabase:
     """Hiking sesssion database interface class.
@@ -26,74 +355,490 @@ class HubDatabase:
     hiking database content. If the database does not exist, the instantiation
     of this class will create the database inside `DB_FILE_NAME` file.
 
+    The same object can be used from multiple threads: each thread gets its own
+    connection from `db`, so reads run concurrently with a sync in progress.
+
+    Single sessions and session pages are cached in memory. Every write through
+    this object invalidates exactly the entries it affects, and the caches are
+    dropped when the `version` shows a write of another process.
+
+    Sessions moved to the archive by `archive()` live in a separate database file
+    with compressed tracks, and stay readable through every getter.
+
     Arguments:
-        lock: lock object so multithreaded use of the same HubDatabase object
-              is safe. sqlite3 does not allow the same cursor object to be
-              used concurrently.
-        con: sqlite3 connection object
-        cur: sqlite3 cursor object
+        db: connection manager handing out the per-thread connections.
+        session_cache: `get_session` results by session ID.
+        page_cache: `get_sessions_page` results by (after_id, limit).
+        cache_version: the `version` the cached entries are valid for.
     """
 
-    lock = threading.Lock()
+    def __init__(self, path: str = DB_FILE_NAME, archive_path: str = None):
+        if archive_path is None:
+            archive_path = os.path.splitext(path)[0] + DB_ARCHIVE_SUFFIX
 
-    def __init__(self):
-        self.con = sqlite3.connect(DB_FILE_NAME, check_same_thread=False)
-        self.cur = self.con.cursor()
+        self.db = ConnectionManager(path, attached={'archive': archive_path})
+        self.session_cache = LRUCache(DB_SESSION_CACHE_SIZE)
+        self.page_cache = LRUCache(DB_PAGE_CACHE_SIZE)
+        self.cache_version = None
+        self._cache_lock = threading.Lock()
+
+        with self.db.writing() as cur:
+            has_rollups = cur.execute(
+                "SELECT count(*) FROM sqlite_master WHERE type = 'table' AND name = ?",
+                (DB_ROLLUP_TABLE['name'],)).fetchone()[0]
+
+            for table in (DB_SESSION_TABLE, DB_ROLLUP_TABLE, DB_TRACK_TABLE, DB_VERSION_TABLE):
+                cur.execute(f"create table if not exists main.{table['name']} ({', '.join(table['cols'])})")
+            cur.execute(f"INSERT OR IGNORE INTO main.{DB_VERSION_TABLE['name']} (id, version) VALUES (0, 0)")
+            for table in (DB_SESSION_TABLE, DB_TRACK_TABLE):
+                cur.execute(f"create table if not exists archive.{table['name']} ({', '.join(table['cols'])})")
 
-        # Fixed: don't iterate over DB_SESSION_TABLE as it's a single dictionary
-        create_table_sql = f"create table if not exists {DB_SESSION_TABLE['name']} ({', '.join(DB_SESSION_TABLE['cols'])})"
-        self.cur.execute(create_table_sql)
+            # databases created before sessions were timestamped or tagged with their device,
+            # or before the time of the last change was kept
+            for schema, table in (('main', DB_SESSION_TABLE), ('archive', DB_SESSION_TABLE), ('main', DB_VERSION_TABLE)):
+                existing = [c[1] for c in cur.execute(f"PRAGMA {schema}.table_info({table['name']})")]
+                for col in table['cols']:
+                    if col.split()[0] not in existing:
+                        cur.execute(f"ALTER TABLE {schema}.{table['name']} ADD COLUMN {col}")
 
-        self.con.commit()
+            cur.execute(f"create index if not exists main.sessions_recorded_at "
+                        f"on {DB_SESSION_TABLE['name']} (recorded_at)")
+            # a session the watch sent again because it missed the acknowledgement
+            cur.execute(f"create unique index if not exists main.sessions_received "
+                        f"on {DB_SESSION_TABLE['name']} (device, watch_id, content_hash)")
+
+            if not has_rollups:
+                HubDatabase._update_rollups(cur, "1", (), 1)
 
     def save(self, s: hike.HikeSession):
-        sessions = self.get_sessions()
+        """Saves a single session under the next free session ID.
 
-        if len(sessions) > 0:
-            s.id = sorted(sessions, key=lambda sess: sess.id)[-1].id + 1
-        else:
-            s.id = 1
+        Args:
+            s: the session to save. Its `id` is overwritten by the assigned ID.
+        """
+        self.save_many([s])
 
-        try:
-            self.lock.acquire()
+    def save_many(self, sessions, keep_ids: bool = False, durable: bool = False,
+                  from_watch: bool = True) -> int:
+        """Saves a batch of sessions in a single transaction.
 
-            try:
-                self.cur.execute(f"INSERT INTO {DB_SESSION_TABLE['name']} VALUES ({s.id}, {s.km}, {s.steps}, {s.kcal})")
-            except sqlite3.IntegrityError:
-                print("WARNING: Session ID already exists in database! Aborting saving current session.")
+        Session IDs are allocated from the current maximum of the primary keys of
+        the live and archived sessions, which SQLite resolves with a single B-tree
+        lookup each instead of reading the whole tables.
 
-            self.con.commit()
-        finally:
-            self.lock.release()
+        Sessions received from a watch (with a `device`) are saved along with the
+        ID the watch sent them under and their `hike.content_hash`. A session the
+        watch already sent is found with one probe of the `sessions_received`
+        index and skipped, so a retransmission after a lost acknowledgement is
+        acknowledged again without saving it twice. Only live sessions are probed:
+        the watch deletes a session long before it gets archived.
+
+        Args:
+            sessions: a `hike.SessionBatch` or a list of `hike.HikeSession` to save.
+                      Their IDs are overwritten by the assigned IDs, or by the ID
+                      of the saved copy for retransmissions, and unset timestamps
+                      by the current time.
+            keep_ids: save the sessions under their own ID instead, skipping those
+                      whose ID is already taken. Used to restore a backup.
+            durable: only return once the sessions are flushed to storage, see
+                     `ConnectionManager.writing`. Required before acknowledging them to a watch.
+            from_watch: whether the sessions with a `device` come straight from it. Imported
+                      ones do not, their `id` is not the one their watch sent them under,
+                      so they are saved without a watch ID and are not probed.
+
+        Returns:
+            int: the number of saved sessions, retransmissions excluded.
+
+        Raises:
+            sqlite3.Error: if the batch could not be saved, in which case none of it is.
+                           A receiver must then not acknowledge the sessions to the watch.
+        """
+        batch = sessions if isinstance(sessions, hike.SessionBatch) else hike.SessionBatch(sessions)
+        if not len(batch):
+            return 0
+        insert = f"INSERT INTO main.{DB_SESSION_TABLE['name']} VALUES ({', '.join('?' * len(DB_SESSION_TABLE['cols']))})"
+
+        now = int(time.time())
+        for i, timestamp in enumerate(batch.timestamps):
+            if not timestamp:
+                batch.timestamps[i] = now
+
+        version = None
+        with self.db.writing(durable) as cur:
+            if keep_ids:
+                taken = set(r[0] for r in cur.execute(
+                    f"SELECT session_id FROM {ALL_SESSIONS} "
+                    f"WHERE session_id IN (SELECT value FROM json_each(?))", (json.dumps(batch.ids.tolist()),)))
+                saved = batch.select([i for i, session_id in enumerate(batch.ids) if session_id not in taken])
+                if not len(saved):
+                    return 0
+                extra = [(None, None)] * len(saved)
+                new_rows = ("session_id IN (SELECT value FROM json_each(?))", (json.dumps(saved.ids.tolist()),))
+            else:
+                keys = [(i, device, batch.ids[i], hike.content_hash(batch.ids[i], batch.km[i], batch.steps[i],
+                                                                    batch.coords[i]))
+                        for i, device in enumerate(batch.devices) if from_watch and device is not None]
+                copies = dict(cur.execute(
+                    f"SELECT json_extract(k.value, '$[0]'), s.session_id FROM json_each(?) k "
+                    f"JOIN main.{DB_SESSION_TABLE['name']} s ON s.device = json_extract(k.value, '$[1]') "
+                    f"AND s.watch_id = json_extract(k.value, '$[2]') "
+                    f"AND s.content_hash = json_extract(k.value, '$[3]')", (json.dumps(keys),))) if keys else {}
+                received = {i: (watch_id, h) for i, _, watch_id, h in keys}
+
+                next_id = cur.execute(
+                    f"SELECT max(coalesce((SELECT max(session_id) FROM main.{DB_SESSION_TABLE['name']}), 0), "
+                    f"coalesce((SELECT max(session_id) FROM archive.{DB_SESSION_TABLE['name']}), 0)) + 1"
+                ).fetchone()[0]
+                new = []
+                seen = {}
+                for i in range(len(batch)):
+                    key = (batch.devices[i], *received[i]) if i in received else None
+                    if i in copies:
+                        batch.ids[i] = copies[i]
+                    elif key in seen:
+                        # sent twice within the batch
+                        batch.ids[i] = batch.ids[seen[key]]
+                    else:
+                        batch.ids[i] = next_id + len(new)
+                        new.append(i)
+                        if key is not None:
+                            seen[key] = i
+                saved = batch if len(new) == len(batch) else batch.select(new)
+                extra = [received.get(i, (None, None)) for i in new]
+                new_rows = ("session_id >= ?", (next_id,))
+
+            if len(saved):
+                cur.executemany(insert, (row + e for row, e in zip(saved.rows(), extra)))
+                HubDatabase._update_rollups(cur, *new_rows, 1)
+                version = HubDatabase._changed(cur)
+
+                tracks = [(session_id, hike.pack_coords(coords))
+                          for session_id, coords in zip(saved.ids, saved.coords) if len(coords)]
+                if tracks:
+                    cur.executemany(f"INSERT INTO main.{DB_TRACK_TABLE['name']} VALUES (?, ?)", tracks)
+
+        if batch is not sessions:
+            for s, session_id, timestamp in zip(sessions, batch.ids, batch.timestamps):
+                s.id = session_id
+                s.timestamp = timestamp
+
+        self._invalidate_pages(saved.ids.tolist(), inserted=True)
+        self._written(version)
+        return len(saved)
 
     def delete(self, session_id: int):
-        try:
-            self.lock.acquire()
+        session_id = int(session_id)
+        with self.db.writing() as cur:
+            for schema in ('main', 'archive'):
+                HubDatabase._update_rollups(cur, "session_id = ?", (session_id,), -1,
+                                            f"{schema}.{DB_SESSION_TABLE['name']}")
+                cur.execute(f"DELETE FROM {schema}.{DB_SESSION_TABLE['name']} WHERE session_id = ?", (session_id,))
+                cur.execute(f"DELETE FROM {schema}.{DB_TRACK_TABLE['name']} WHERE session_id = ?", (session_id,))
+            version = HubDatabase._changed(cur)
 
-            self.cur.execute(f"DELETE FROM {DB_SESSION_TABLE['name']} WHERE session_id = {session_id}")
-            self.con.commit()
-        finally:
-            self.lock.release()
+        self.session_cache.invalidate(session_id)
+        self._invalidate_pages([session_id], inserted=False)
+        self._written(version)
 
-    def get_sessions(self) -> list[hike.HikeSession]:
-        try:
-            self.lock.acquire()
-            rows = self.cur.execute(f"SELECT * FROM {DB_SESSION_TABLE['name']}").fetchall()
-        finally:
-            self.lock.release()
+    def _written(self, version: int):
+        """Keeps the caches, which a write of this object just updated, valid for the `version` it reached."""
+        with self._cache_lock:
+            if version is not None and self.cache_version == version - 1:
+                self.cache_version = version
+
+    def _validate_caches(self):
+        """Drops the caches if another process changed the sessions since they were filled."""
+        version = self.version()
+        with self._cache_lock:
+            if version != self.cache_version:
+                self.session_cache.clear()
+                self.page_cache.clear()
+                self.cache_version = version
+
+    def _invalidate_pages(self, session_ids: list[int], inserted: bool):
+        """Drops the cached pages whose content changes by inserting or deleting `session_ids`.
+
+        A page (after_id, limit) holding sessions up to ID `last` contains the IDs in
+        (after_id, last]. A page that is not full also gains any inserted ID above after_id.
+        """
+        session_ids = sorted(session_ids)
+
+        def affected(key, page):
+            after_id, limit = key
+            i = bisect.bisect_right(session_ids, after_id)
+            if i == len(session_ids):
+                return False
+            if inserted and len(page) < limit:
+                return True
+            return bool(len(page)) and session_ids[i] <= page.ids[-1]
+
+        self.page_cache.invalidate_if(affected)
+
+    @staticmethod
+    def _changed(cur: sqlite3.Cursor) -> int:
+        """Bumps the database version, inside the write transaction changing the sessions, and returns it."""
+        cur.execute(f"UPDATE main.{DB_VERSION_TABLE['name']} SET version = version + 1, changed_at = ?",
+                    (time.time(),))
+        return cur.execute(f"SELECT version FROM main.{DB_VERSION_TABLE['name']}").fetchone()[0]
+
+    def version(self) -> int:
+        """Returns a counter bumped by every write that adds or removes sessions, from any process.
+
+        It is a single row read, cheap enough to validate cached renderings of the
+        sessions on every request. Archiving does not change it, as archived
+        sessions read the same as live ones.
+        """
+        return self.last_change()[0]
+
+    def last_change(self) -> tuple[int, float]:
+        """Returns the `version` and the unix time it was reached at, 0 before the first change."""
+        with self.db.reading() as cur:
+            return cur.execute(f"SELECT version, changed_at FROM main.{DB_VERSION_TABLE['name']}").fetchone()
+
+    @staticmethod
+    def _update_rollups(cur: sqlite3.Cursor, where: str, params: tuple, sign: int,
+                        table: str = f"main.{DB_SESSION_TABLE['name']}"):
+        """Adds (`sign` = 1) or subtracts (`sign` = -1) the sessions of `table` matching `where` to the rollups.
+
+        Must be called inside the write transaction that inserts the sessions, or
+        before the one deleting them, so the rollups never disagree with the sessions.
+        """
+        for granularity, period in ROLLUP_PERIODS.items():
+            cur.execute(
+                f"INSERT INTO {DB_ROLLUP_TABLE['name']} "
+                f"SELECT ?, {period}, ? * count(*), ? * sum(km), ? * sum(steps), ? * sum(max(burnt_kcal, 0)) "
+                f"FROM {table} WHERE ({where}) AND {period} IS NOT NULL GROUP BY 2 "
+                f"ON CONFLICT (granularity, period) DO UPDATE SET "
+                f"sessions = sessions + excluded.sessions, km = km + excluded.km, "
+                f"steps = steps + excluded.steps, kcal = kcal + excluded.kcal",
+                (granularity, sign, sign, sign, sign) + params)
+
+        cur.execute(f"DELETE FROM {DB_ROLLUP_TABLE['name']} WHERE sessions <= 0")
+
+    def get_totals(self) -> dict:
+        """Returns the number of sessions and the total km, steps and kcal of all sessions."""
+        rollups = self.get_rollups("all", 1)
+        return rollups[0] if rollups else {"period": "all", "sessions": 0, "km": 0.0, "steps": 0, "kcal": 0}
+
+    def get_rollups(self, granularity: str, limit: int = DB_PAGE_SIZE) -> list[dict]:
+        """Returns the totals of the latest `limit` periods of a granularity, newest first.
 
-        return list(map(lambda r: hike.from_list(r), rows))
+        Args:
+            granularity: one of the keys of `ROLLUP_PERIODS`: "day", "week" or "all".
+        """
+        with self.db.reading() as cur:
+            rows = cur.execute(
+                f"SELECT period, sessions, km, steps, kcal FROM {DB_ROLLUP_TABLE['name']} "
+                f"WHERE granularity = ? ORDER BY period DESC LIMIT ?", (granularity, limit)).fetchall()
+
+        return [{"period": r[0], "sessions": r[1], "km": round(r[2], 3), "steps": r[3], "kcal": r[4]} for r in rows]
+
+    def last_session_id(self) -> int:
+        """Returns the greatest ID of the live and archived sessions, 0 without sessions."""
+        with self.db.reading() as cur:
+            return cur.execute(
+                f"SELECT max(coalesce((SELECT max(session_id) FROM main.{DB_SESSION_TABLE['name']}), 0), "
+                f"coalesce((SELECT max(session_id) FROM archive.{DB_SESSION_TABLE['name']}), 0))").fetchone()[0]
+
+    def get_sessions(self) -> hike.SessionBatch:
+        with self.db.reading() as cur:
+            rows = cur.execute(f"SELECT * FROM {ALL_SESSIONS} ORDER BY session_id").fetchall()
+
+        return hike.SessionBatch.from_rows(rows)
+
+    def get_sessions_page(self, after_id: int = 0, limit: int = DB_PAGE_SIZE) -> hike.SessionBatch:
+        """Returns at most `limit` sessions with an ID greater than `after_id`, ordered by ID.
+
+        The query seeks directly to `after_id` on the primary key, so the cost of
+        a page does not depend on how many sessions precede it. Pass the ID of the
+        last session of a page as `after_id` to get the next page.
+
+        The returned batch may be shared with other callers and must not be modified.
+        """
+        self._validate_caches()
+        page = self.page_cache.get((after_id, limit))
+        if page is None:
+            generation = self.page_cache.generation
+            with self.db.reading() as cur:
+                rows = cur.execute(
+                    f"SELECT * FROM {ALL_SESSIONS} WHERE session_id > ? ORDER BY session_id LIMIT ?",
+                    (after_id, limit)).fetchall()
+
+            page = hike.SessionBatch.from_rows(rows)
+            self.page_cache.put((after_id, limit), page, generation)
+
+        return page
+
+    def iter_batches(self, after_id: int = 0, batch_size: int = DB_FETCH_SIZE, with_tracks: bool = False):
+        """Generator yielding every session with an ID greater than `after_id`, ordered by ID, in batches.
+
+        Rows are fetched `batch_size` at a time into a `hike.SessionBatch`, so only
+        one batch is held in memory. With `with_tracks` the `coords` of each session
+        is set to its track, as returned by `get_track`.
+        """
+        if with_tracks:
+            sql = (f"SELECT s.*, t.points, a.points FROM {ALL_SESSIONS} s "
+                   f"LEFT JOIN main.{DB_TRACK_TABLE['name']} t USING (session_id) "
+                   f"LEFT JOIN archive.{DB_TRACK_TABLE['name']} a USING (session_id) "
+                   f"WHERE s.session_id > ? ORDER BY s.session_id")
+        else:
+            sql = f"SELECT * FROM {ALL_SESSIONS} WHERE session_id > ? ORDER BY session_id"
+
+        with self.db.reading() as cur:
+            cur.execute(sql, (after_id,))
+            while True:
+                rows = cur.fetchmany(batch_size)
+                if not rows:
+                    break
+                if not with_tracks:
+                    yield hike.SessionBatch.from_rows(rows)
+                    continue
+
+                batch = hike.SessionBatch()
+                for r in rows:
+                    points = r[-2] if r[-2] is not None or r[-1] is None else zlib.decompress(r[-1])
+                    batch.append_row(r[:-2], memoryview(points or b'').cast('d'))
+                yield batch
+
+    def iter_json(self, fields: tuple = SESSION_FIELDS, after_id: int = 0, since: float = None,
+                  batch_size: int = DB_FETCH_SIZE):
+        """Generator yielding the sessions with an ID greater than `after_id`, ordered by ID, as JSON.
+
+        Each session is a JSON array of its `fields`, built by SQLite, so rows go
+        from the cursor to the caller without being converted to Python values.
+        They come in lists of up to `batch_size`, so only one fetch is held in memory.
+
+        Args:
+            fields: names of the returned fields, among `SESSION_FIELDS`.
+            since: unix time; only the sessions recorded from then on are returned.
+
+        Raises:
+            ValueError: if a field is unknown.
+        """
+        for field in fields:
+            if field not in SESSION_FIELDS:
+                raise ValueError(f"Unknown field: {field}")
+        where, params = "session_id > ?", (after_id,)
+        if since is not None:
+            where, params = where + " AND recorded_at >= ?", params + (since,)
+
+        with self.db.reading() as cur:
+            cur.execute(f"SELECT json_array({', '.join(fields)}) FROM {ALL_SESSIONS} "
+                        f"WHERE {where} ORDER BY session_id", params)
+            while True:
+                rows = cur.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield [r[0] for r in rows]
+
+    def iter_sessions(self, after_id: int = 0, batch_size: int = DB_FETCH_SIZE, with_tracks: bool = False):
+        """Generator yielding every session with an ID greater than `after_id`, ordered by ID.
+
+        See `iter_batches`.
+        """
+        for batch in self.iter_batches(after_id, batch_size, with_tracks):
+            yield from batch
 
     def get_session(self, session_id: int) -> hike.HikeSession:
-        try:
-            self.lock.acquire()
-            rows = self.cur.execute(
-                f"SELECT * FROM {DB_SESSION_TABLE['name']} WHERE session_id = {session_id}").fetchall()
-        finally:
-            self.lock.release()
+        """Returns a session by its ID, from the cache if possible.
+
+        The returned object may be shared with other callers and must not be modified.
+        """
+        session_id = int(session_id)
+        self._validate_caches()
+        s = self.session_cache.get(session_id)
+        if s is None:
+            generation = self.session_cache.generation
+            with self.db.reading() as cur:
+                rows = cur.execute(
+                    f"SELECT * FROM main.{DB_SESSION_TABLE['name']} WHERE session_id = ? UNION ALL "
+                    f"SELECT * FROM archive.{DB_SESSION_TABLE['name']} WHERE session_id = ?",
+                    (session_id, session_id)).fetchall()
+
+            s = hike.from_list(rows[0])
+            self.session_cache.put(session_id, s, generation)
+
+        return s
+
+    def get_track(self, session_id: int) -> memoryview:
+        """Returns the GPS track of a session as a flat view of doubles: lat1, long1, lat2, long2, ...
+
+        The view is cast directly over the blob returned by SQLite, so no Python
+        float is created until an element is accessed. Archived tracks are
+        decompressed first. An empty view is returned if the session has no track.
+        """
+        with self.db.reading() as cur:
+            row = cur.execute(
+                f"SELECT points FROM main.{DB_TRACK_TABLE['name']} WHERE session_id = ?", (session_id,)).fetchone()
+            if row is None:
+                row = cur.execute(
+                    f"SELECT points FROM archive.{DB_TRACK_TABLE['name']} WHERE session_id = ?",
+                    (session_id,)).fetchone()
+                if row is not None:
+                    row = (zlib.decompress(row[0]),)
+
+        return memoryview(row[0] if row else b'').cast('d')
+
+    def archive(self, older_than: float, limit: int = DB_FETCH_SIZE) -> int:
+        """Moves up to `limit` of the sessions recorded before `older_than` to the archive.
+
+        Their tracks are compressed on the way. Sessions recorded before the hub
+        timestamped sessions are never archived. As archived sessions read the same
+        as live ones, neither the caches nor the rollups change.
+
+        Args:
+            older_than: unix time; sessions recorded before it are archived.
+            limit: maximum number of sessions moved in this transaction.
+
+        Returns:
+            int: the number of archived sessions.
+        """
+        with self.db.writing() as cur:
+            ids = [r[0] for r in cur.execute(
+                f"SELECT session_id FROM main.{DB_SESSION_TABLE['name']} WHERE recorded_at < ? "
+                f"ORDER BY session_id LIMIT ?", (older_than, limit))]
+            if not ids:
+                return 0
+
+            selection = ("session_id IN (SELECT value FROM json_each(?))", (json.dumps(ids),))
+            tracks = cur.execute(
+                f"SELECT session_id, points FROM main.{DB_TRACK_TABLE['name']} WHERE {selection[0]}",
+                selection[1]).fetchall()
+            cur.executemany(
+                f"INSERT OR REPLACE INTO archive.{DB_TRACK_TABLE['name']} VALUES (?, ?)",
+                [(session_id, zlib.compress(points, ARCHIVE_COMPRESSION_LEVEL)) for session_id, points in tracks])
+
+            cur.execute(
+                f"INSERT OR REPLACE INTO archive.{DB_SESSION_TABLE['name']} "
+                f"SELECT * FROM main.{DB_SESSION_TABLE['name']} WHERE {selection[0]}", selection[1])
+            cur.execute(f"DELETE FROM main.{DB_TRACK_TABLE['name']} WHERE {selection[0]}", selection[1])
+            cur.execute(f"DELETE FROM main.{DB_SESSION_TABLE['name']} WHERE {selection[0]}", selection[1])
+
+        return len(ids)
+
+    def compact(self, pages: int = 0):
+        """Returns up to `pages` free pages of both database files to the file system, all if 0.
+
+        A database created before incremental vacuuming was enabled is converted by
+        a full VACUUM the first time, which rewrites the whole file.
+        """
+        with self.db.maintaining() as cur:
+            for schema in ('main', 'archive'):
+                if cur.execute(f"PRAGMA {schema}.auto_vacuum").fetchone()[0] != 2:
+                    cur.execute(f"PRAGMA {schema}.auto_vacuum = INCREMENTAL")
+                    cur.execute(f"VACUUM {schema}")
+                else:
+                    # frees one page per step, which only executescript() steps to completion
+                    cur.executescript(f"PRAGMA {schema}.incremental_vacuum({pages});")
+                cur.execute(f"PRAGMA {schema}.wal_checkpoint(TRUNCATE)").fetchall()
 
-        return hike.from_list(rows[0])
+    def stats(self) -> dict:
+        """Returns the lock, busy and read wait time statistics and the cache counters of the database."""
+        return {
+            **self.db.stats(),
+            "session_cache": self.session_cache.snapshot(),
+            "page_cache": self.page_cache.snapshot(),
+        }
 
     def __del__(self):
-        self.cur.close()
-        self.con.close()
\ No newline at end of file
+        self.db.close()
@@ -0,0 +1,151 @@
+import json
+import secrets
+import threading
+from collections import deque
+
+# events kept for the clients reconnecting after missing some, older ones have to reload the page
+EVENT_HISTORY = 256
+# seconds between the comments keeping an idle event stream open through proxies
+SSE_KEEPALIVE = 15.0
+
+
+class ChangeFeed:
+    """Broadcasts the changes of the sessions to the open pages as Server-Sent Events.
+
+    Writers `publish()` an event once their transaction is committed. Every
+    connected client is served by a `stream()` generator blocked on a condition
+    variable between events, so an idle page costs neither a query nor a wakeup
+    beyond the keepalive.
+
+    Events are identified by `<epoch>-<sequence number>-<version>`, the epoch
+    telling apart the runs of the server, and the version being the database
+    version (see `db.HubDatabase.version`) every change up to which the client
+    was sent. A page passes the `last_id` it was rendered at, and the browser the
+    id of the last event it received when reconnecting, so no event is missed in
+    between. An id of another process, such as another web worker or an earlier
+    run of the server, is resumed from if the database is still at its version.
+    Otherwise, and when its events fell out of the history, the client is told
+    to `reload`. An event may therefore arrive for a change the page already
+    shows, which clients ignore.
+
+    Attributes:
+        epoch: random identifier of this run of the server
+        seq: sequence number of the last published event
+        version: the database version the last published event brought the clients to
+        events: the last `history` events, as (sequence number, formatted event) pairs
+        clients: number of open streams
+    """
+
+    def __init__(self, current_version, history: int = EVENT_HISTORY):
+        """
+        Args:
+            current_version: callable returning the current version of the database, shared by the processes.
+        """
+        self.current_version = current_version
+        self.epoch = secrets.token_hex(4)
+        self.seq = 0
+        self.version = current_version()
+        self.events = deque(maxlen=history)
+        self.clients = 0
+        self.closed = False
+        self.condition = threading.Condition()
+
+    @property
+    def last_id(self) -> str:
+        return self.event_id(self.seq, self.version)
+
+    def event_id(self, seq: int, version: int) -> str:
+        """Returns the id of a client that got the events up to `seq` and is at database `version`."""
+        return f"{self.epoch}-{seq}-{version}"
+
+    def publish(self, name: str, data: dict, version: int = None):
+        """Sends an event named `name` with `data` as JSON to every client, formatted only once.
+
+        Args:
+            version: the database version the clients are at once they applied
+                     every event up to this one, if known; the last one otherwise.
+        """
+        with self.condition:
+            self._append(f"event: {name}\ndata: {json.dumps(data)}\n\n", version)
+
+    def advance(self, version: int):
+        """Tells the clients they are at `version`, every change up to it having been published.
+
+        Sent as an event with an id only, which browsers remember without dispatching it.
+        """
+        with self.condition:
+            if version > self.version:
+                self._append("\n", version)
+
+    def _append(self, event: str, version: int = None):
+        self.seq += 1
+        if version is not None:
+            self.version = max(self.version, version)
+        self.events.append((self.seq, f"id: {self.last_id}\n{event}"))
+        self.condition.notify_all()
+
+    def _since(self, last_id: str):
+        """Returns the sequence number to resume the client with id `last_id` from, None if it must reload."""
+        epoch, seq, version = ((last_id or '').split('-') + ['', ''])[:3]
+        if epoch == self.epoch and seq.isdigit() and int(seq) <= self.seq:
+            with self.condition:
+                if not self.events or int(seq) >= self.events[0][0] - 1:
+                    return int(seq)
+        # sent by another process, or out of the history: nothing was missed if nothing changed since
+        if version.isdigit() and int(version) == self.current_version():
+            return self.seq
+        return None
+
+    def wait(self, seq: int, timeout: float) -> list[str]:
+        """Waits up to `timeout` seconds for events after `seq`.
+
+        Returns:
+            list[str]: the formatted events published after `seq`, empty on timeout.
+            None: if some of them fell out of the history.
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self.seq > seq or self.closed, timeout)
+            if self.events and seq < self.events[0][0] - 1:
+                return None
+            return [event for s, event in self.events if s > seq]
+
+    def stream(self, last_id: str = None, keepalive: float = SSE_KEEPALIVE):
+        """Generator of the text/event-stream response of a client, ending when the feed is closed.
+
+        Args:
+            last_id: id of the last event the client has seen, see `last_id`.
+                     Without one, the client gets the events published from now on.
+        """
+        seq = self._since(last_id) if last_id else self.seq
+        with self.condition:
+            self.clients += 1
+        try:
+            if seq is None:
+                yield "event: reload\ndata: {}\n\n"
+                return
+            # shortens the browser's reconnection delay after a restart of the server
+            yield "retry: 1000\n\n"
+            while not self.closed:
+                events = self.wait(seq, keepalive)
+                if events is None:
+                    yield "event: reload\ndata: {}\n\n"
+                    return
+                if not events:
+                    yield ": keepalive\n\n"
+                    continue
+                seq += len(events)
+                yield ''.join(events)
+        finally:
+            with self.condition:
+                self.clients -= 1
+
+    def stats(self) -> dict:
+        with self.condition:
+            return {"last_id": self.last_id, "version": self.version, "clients": self.clients,
+                    "history": len(self.events)}
+
+    def close(self):
+        """Ends every stream."""
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
@@ -1,12 +1,27 @@
+import hashlib
+import struct
+from array import array
+
 MET_HIKING = 6
 KCAL_PER_STEP = 0.005
 
 class HikeSession:
-    id = 0
-    km = 0
-    steps = 0
-    kcal = -1
-    coords = []
+    """A single hiking session.
+
+    Slotted, so an instance carries no `__dict__`. `coords` holds the GPS track as
+    anything `pack_coords` accepts, an empty tuple by default.
+    """
+
+    __slots__ = ('id', 'km', 'steps', 'kcal', 'timestamp', 'device', 'coords')
+
+    def __init__(self, id=0, km=0, steps=0, kcal=-1, timestamp=0, device=None, coords=()):
+        self.id = id
+        self.km = km
+        self.steps = steps
+        self.kcal = kcal
+        self.timestamp = timestamp  # unix time the session was recorded on the hub
+        self.device = device  # the watch the session was received from, None if entered by hand
+        self.coords = coords
 
     # represents a computationally intensive calculation done by lazy execution.
     def calc_kcal(self):
@@ -16,13 +31,131 @@ class HikeSession:
     def __repr__(self):
         return f"HikeSession{{{self.id}, {self.km}(km), {self.steps}(steps), {self.kcal:.2f}(kcal)}}"
 
+class SessionBatch:
+    """Columnar container of hiking sessions.
+
+    Every field is kept in its own typed array, so a batch of n sessions costs a
+    handful of objects instead of n `HikeSession` instances. Indexing and iterating
+    create `HikeSession` objects on demand; `rows()` avoids them entirely.
+
+    Attributes:
+        ids, km, steps, kcal, timestamps: one array per field, indexed by position in the batch
+        devices: the source device of every session
+        coords: the track of every session, packed by `pack_coords` or as a view from the database
+    """
+
+    __slots__ = ('ids', 'km', 'steps', 'kcal', 'timestamps', 'devices', 'coords')
+
+    def __init__(self, sessions=()):
+        self.ids = array('q')
+        self.km = array('d')
+        self.steps = array('q')
+        self.kcal = array('q')
+        self.timestamps = array('q')
+        self.devices = []
+        self.coords = []
+        for s in sessions:
+            self.append(s)
+
+    @classmethod
+    def from_rows(cls, rows) -> 'SessionBatch':
+        """Creates a batch from rows in the `to_list` layout, such as database rows."""
+        batch = cls()
+        for r in rows:
+            batch.append_row(r)
+        return batch
+
+    def append(self, s: HikeSession):
+        self.append_row(to_list(s), s.coords)
+
+    def append_row(self, row, coords=()):
+        self.ids.append(row[0])
+        self.km.append(row[1])
+        self.steps.append(row[2])
+        self.kcal.append(int(round(row[3])))
+        self.timestamps.append((row[4] or 0) if len(row) > 4 else 0)
+        self.devices.append(row[5] if len(row) > 5 else None)
+        # tracks read from the database stay zero-copy views, sessions without one share the empty tuple
+        if not coords:
+            coords = ()
+        elif not isinstance(coords, memoryview):
+            coords = pack_coords(coords)
+        self.coords.append(coords)
+
+    def select(self, indices) -> 'SessionBatch':
+        """Returns a new batch of the sessions at `indices`."""
+        batch = SessionBatch()
+        for i in indices:
+            batch.append_row((self.ids[i], self.km[i], self.steps[i], self.kcal[i], self.timestamps[i],
+                              self.devices[i]), self.coords[i])
+        return batch
+
+    def extend(self, batch: 'SessionBatch'):
+        """Appends the sessions of another batch."""
+        self.ids.extend(batch.ids)
+        self.km.extend(batch.km)
+        self.steps.extend(batch.steps)
+        self.kcal.extend(batch.kcal)
+        self.timestamps.extend(batch.timestamps)
+        self.devices.extend(batch.devices)
+        self.coords.extend(batch.coords)
+
+    def tag(self, device: str):
+        """Marks every session of the batch as received from `device`."""
+        self.devices = [device] * len(self.ids)
+
+    def calc_kcal(self):
+        """Calculates the burnt calories of every session of the batch, see `HikeSession.calc_kcal`."""
+        for i, steps in enumerate(self.steps):
+            self.kcal[i] = int(round(MET_HIKING * KCAL_PER_STEP * steps, 0))
+
+    def rows(self):
+        """Returns an iterator of the sessions as tuples in the `to_list` layout."""
+        return zip(self.ids, self.km, self.steps, self.kcal, self.timestamps, self.devices)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, i) -> HikeSession:
+        return HikeSession(self.ids[i], self.km[i], self.steps[i], self.kcal[i], self.timestamps[i], self.devices[i],
+                           self.coords[i])
+
+    def __iter__(self):
+        for i in range(len(self.ids)):
+            yield self[i]
+
+    def __repr__(self):
+        return f"SessionBatch{list(self)}"
+
 def to_list(s: HikeSession) -> list:
-    return [s.id, s.km, s.steps, s.kcal]
+    return [s.id, s.km, s.steps, s.kcal, s.timestamp, s.device]
 
 def from_list(l: list) -> HikeSession:
-    s = HikeSession()
-    s.id = l[0]
-    s.km = l[1]
-    s.steps = l[2]
-    s.kcal = l[3]
-    return s
\ No newline at end of file
+    return HikeSession(l[0], l[1], l[2], l[3], l[4] if len(l) > 4 and l[4] is not None else 0,
+                       l[5] if len(l) > 5 else None)
+
+def content_hash(watch_id: int, km: float, steps: int, coords) -> int:
+    """Returns a signed 64-bit hash of a session as sent by a watch, the same for every retransmission of it."""
+    h = hashlib.blake2b(struct.pack('<qdq', watch_id, km, steps), digest_size=8)
+    if len(coords):
+        h.update(coords if isinstance(coords, (array, memoryview)) else pack_coords(coords))
+    return int.from_bytes(h.digest(), 'little', signed=True)
+
+def pack_coords(coords) -> array:
+    """Packs an iterable of (lat, long) pairs into a flat array of doubles: lat1, long1, lat2, long2, ...
+
+    An `array('d')` is returned as is, and a flat view of doubles (see `db.HubDatabase.get_track`)
+    is copied without unpacking.
+    """
+    if isinstance(coords, array) and coords.typecode == 'd':
+        return coords
+    if isinstance(coords, memoryview) and coords.format == 'd':
+        packed = array('d')
+        packed.frombytes(coords.cast("B"))
+        return packed
+
+    packed = array('d')
+    for lat, long in coords:
+        packed.append(lat)
+        packed.append(long)
+    return packed
@@ -0,0 +1,162 @@
+import asyncio
+import fcntl
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import db
+import hike
+
+# batches waiting for the writer, receivers wait beyond it and stop reading their socket
+INGEST_QUEUE_SIZE = 64
+# most sessions written per group commit
+GROUP_COMMIT_MAX_SESSIONS = 1024
+# file locked by the one process receiving the sessions, see `IngestLock`
+INGEST_LOCK_FILE_NAME = 'ingest.lock'
+
+
+class IngestPipeline:
+    """Decouples the receivers of the watches from the database writes.
+
+    Receivers `submit()` their parsed batches to a bounded queue and wait until
+    the batch is committed, then acknowledge it. A single writer thread takes
+    everything queued while it was busy, up to `max_sessions`, and hands it to
+    `callback` as one `hike.SessionBatch`, so one storage flush covers the batches
+    of every watch received meanwhile (group commit). If that commit fails, each
+    batch is committed again in its own transaction, and only those still failing
+    are not acknowledged.
+
+    A receiver waiting on a full queue or on its commit does not read its socket,
+    so when the writer falls behind the watches are held back by the transport's
+    flow control instead of the Hub buffering their sessions.
+
+    Attributes:
+        callback: one parameter function saving a `hike.SessionBatch` durably, run on the writer thread
+        queue: the `asyncio.Queue` of (batch, future) pairs waiting for the writer
+        commits: `db.WaitStats` of the duration of each group commit
+        sessions: number of committed sessions
+    """
+
+    def __init__(self, callback, queue_size: int = INGEST_QUEUE_SIZE,
+                 max_sessions: int = GROUP_COMMIT_MAX_SESSIONS):
+        self.callback = callback
+        self.max_sessions = max_sessions
+        self.queue = asyncio.Queue(queue_size)
+        self.executor = ThreadPoolExecutor(1, thread_name_prefix='ingest-writer')
+        self.commits = db.WaitStats()
+        self.sessions = 0
+        self.largest_group = 0
+
+    async def submit(self, sessions: hike.SessionBatch):
+        """Queues a batch and returns once it is committed.
+
+        Raises:
+            Exception: whatever `callback` raised for the batch.
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((sessions, future))
+        await future
+
+    async def run(self):
+        """Commits the queued batches until cancelled."""
+        loop = asyncio.get_running_loop()
+        pending = []
+        try:
+            while True:
+                pending = [await self.queue.get()]
+                count = len(pending[0][0])
+                while count < self.max_sessions and not self.queue.empty():
+                    pending.append(self.queue.get_nowait())
+                    count += len(pending[-1][0])
+
+                live = [(sessions, future) for sessions, future in pending if not future.cancelled()]
+                group = hike.SessionBatch()
+                for sessions, _ in live:
+                    group.extend(sessions)
+
+                start = time.perf_counter()
+                try:
+                    await loop.run_in_executor(self.executor, self.callback, group)
+                    errors = [None] * len(live)
+                    self.largest_group = max(self.largest_group, len(group))
+                except Exception as e:
+                    # one bad batch must not fail the batches of the other watches along with it
+                    errors = [await self._commit_alone(sessions) for sessions, _ in live] if len(live) > 1 else [e]
+                finally:
+                    self.commits.record(time.perf_counter() - start)
+
+                for (sessions, future), error in zip(live, errors):
+                    if error is None:
+                        self.sessions += len(sessions)
+                    if future.done():
+                        continue
+                    if error is None:
+                        future.set_result(None)
+                    else:
+                        future.set_exception(error)
+                pending = []
+        finally:
+            # nothing acknowledges the batches left behind, the watches send them again
+            while not self.queue.empty():
+                pending.append(self.queue.get_nowait())
+            for _, future in pending:
+                future.cancel()
+
+    async def _commit_alone(self, sessions: hike.SessionBatch):
+        """Commits a batch of a failed group in its own transaction, returns what `callback` raised, if anything."""
+        try:
+            await asyncio.get_running_loop().run_in_executor(self.executor, self.callback, sessions)
+        except Exception as e:
+            return e
+        return None
+
+    def stats(self) -> dict:
+        commits = self.commits.snapshot()
+        return {
+            "queued": self.queue.qsize(),
+            "sessions": self.sessions,
+            "commits": commits,
+            "avg_group": round(self.sessions / commits["count"], 1) if commits["count"] else 0.0,
+            "largest_group": self.largest_group,
+        }
+
+    def close(self):
+        # a commit in progress is finished, its watches are not acknowledged and send the sessions again
+        self.executor.shutdown(wait=True)
+
+
+class IngestLock:
+    """Exclusive `flock` on a file, held by the one process receiving and committing the sessions.
+
+    Several processes serving the web app may run at once, but only one may
+    connect to the watches. The kernel releases the lock when its holder exits,
+    however it exits, so a process blocked in `acquire()` takes over.
+    """
+
+    def __init__(self, path: str = INGEST_LOCK_FILE_NAME):
+        self.path = path
+        self.file = None
+
+    @property
+    def held(self) -> bool:
+        return self.file is not None
+
+    def acquire(self, blocking: bool = True) -> bool:
+        """Takes the lock, waiting for its holder to release it if `blocking`.
+
+        Returns:
+            bool: whether the lock was taken.
+        """
+        f = open(self.path, 'a')
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            f.close()
+            return False
+        self.file = f
+        return True
+
+    def release(self):
+        if self.file is not None:
+            fcntl.flock(self.file, fcntl.LOCK_UN)
+            self.file.close()
+            self.file = None
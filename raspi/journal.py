@@ -0,0 +1,287 @@
+"""Write-ahead journal of the raw frames received from the watches.
+
+Every complete frame is appended to a memory-mapped file before it is parsed,
+and retired once its sessions are committed, so neither a frame the parser
+rejects nor a crash between receiving and committing loses a hike. Records
+still pending at startup are replayed through the regular ingest callback.
+
+Run as a script, it feeds the frames of a journal through the parser as fast as
+possible, to benchmark the parser on real traffic:
+
+    python journal.py frames.journal --repeat 10
+    python journal.py frames.journal.rejected --rejected
+"""
+import argparse
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+import zlib
+
+import hike
+import protocol
+
+JOURNAL_FILE_NAME = 'frames.journal'
+# frames the parser rejected are moved to this file next to the journal
+JOURNAL_REJECTED_SUFFIX = '.rejected'
+# initial size of the journal file, it doubles whenever full
+JOURNAL_INITIAL_SIZE = 1024 * 1024
+# once everything is retired, writing starts over at the beginning past this offset
+JOURNAL_WRAP_SIZE = 4 * 1024 * 1024
+
+# file header: magic, offset of the first record not retired yet
+JOURNAL_MAGIC = b'HUBJRNL1'
+JOURNAL_HEADER = struct.Struct('<8sQ')
+# record header: frame length, CRC-32 of device and frame, sequence number, device length;
+# followed by the device id (utf-8) and the frame. A zero length ends the journal.
+JOURNAL_RECORD = struct.Struct('<IIQH')
+
+
+def iter_records(buffer, offset: int = 0):
+    """Generator yielding (offset, end, sequence, device, frame) for every valid record from `offset`.
+
+    Stops at the end marker, at the end of `buffer`, or at the first record
+    failing its checksum, such as one torn by a crash.
+    """
+    size = len(buffer)
+    while offset + JOURNAL_RECORD.size <= size:
+        length, checksum, seq, device_length = JOURNAL_RECORD.unpack_from(buffer, offset)
+        if not length:
+            return
+        start = offset + JOURNAL_RECORD.size
+        end = start + device_length + length
+        if end > size:
+            return
+        body = bytes(buffer[start:end])
+        if zlib.crc32(body) != checksum:
+            return
+        yield offset, end, seq, body[:device_length].decode(), body[device_length:]
+        offset = end
+
+
+def encode_record(seq: int, device: str, frame: bytes) -> bytes:
+    body = device.encode() + frame
+    return JOURNAL_RECORD.pack(len(frame), zlib.crc32(body), seq, len(body) - len(frame)) + body
+
+
+class FrameJournal:
+    """Append-only journal of raw frames in a memory-mapped file.
+
+    Receivers `append()` each frame before parsing it and `retire()` it once its
+    session is committed, or once it is certain not to be needed, such as when
+    the watch was not acknowledged and keeps the session. The header records the
+    offset of the oldest record not retired yet, so a replay starts there; later
+    records that were already retired are replayed too, which the duplicate
+    detection of `db.HubDatabase.save_many` absorbs.
+
+    Writes land in the page cache through the mapping, so they survive a crash of
+    the process without a system call per frame; call `sync()` to also survive
+    a crash of the system.
+
+    Attributes:
+        path: the journal file
+        rejected_path: the file receiving the frames the parser rejected
+        tail: offset where the next record is written
+        offsets: start offsets of the records not retired yet, by sequence number
+    """
+
+    def __init__(self, path: str = JOURNAL_FILE_NAME, wrap_size: int = JOURNAL_WRAP_SIZE):
+        self.path = path
+        self.rejected_path = path + JOURNAL_REJECTED_SUFFIX
+        self.wrap_size = wrap_size
+        self.lock = threading.Lock()
+        self.offsets = {}
+        self.appended = 0
+        self.rejected = 0
+
+        new = not os.path.exists(path) or os.path.getsize(path) < JOURNAL_HEADER.size
+        self.file = open(path, 'a+b')
+        if new:
+            self.file.truncate(JOURNAL_INITIAL_SIZE)
+        self.map = mmap.mmap(self.file.fileno(), 0)
+        if new or self.map[:len(JOURNAL_MAGIC)] != JOURNAL_MAGIC:
+            self.map[:JOURNAL_HEADER.size + JOURNAL_RECORD.size] = bytes(JOURNAL_HEADER.size + JOURNAL_RECORD.size)
+            self._set_checkpoint(JOURNAL_HEADER.size)
+
+        self.checkpoint = JOURNAL_HEADER.unpack_from(self.map)[1]
+        self.seq = 0
+        self.tail = self.checkpoint
+        for _, end, seq, _, _ in iter_records(self.map, self.checkpoint):
+            self.tail = end
+            self.seq = max(self.seq, seq)
+
+    def _set_checkpoint(self, offset: int):
+        JOURNAL_HEADER.pack_into(self.map, 0, JOURNAL_MAGIC, offset)
+        self.checkpoint = offset
+
+    def _grow(self, size: int):
+        new_size = len(self.map)
+        while new_size < size:
+            new_size *= 2
+        self.map.close()
+        self.file.truncate(new_size)
+        self.map = mmap.mmap(self.file.fileno(), 0)
+
+    def append(self, device: str, frame: bytes) -> int:
+        """Writes a received frame to the journal.
+
+        Returns:
+            int: the sequence number of the record, to `retire()` or `reject()` it with.
+        """
+        with self.lock:
+            self.seq += 1
+            record = encode_record(self.seq, device, frame)
+            end = self.tail + len(record)
+            # the end marker after the record is written in the same go
+            if end + JOURNAL_RECORD.size > len(self.map):
+                self._grow(end + JOURNAL_RECORD.size)
+            self.map[self.tail:end + JOURNAL_RECORD.size] = record + bytes(JOURNAL_RECORD.size)
+            self.offsets[self.seq] = self.tail
+            self.tail = end
+            self.appended += 1
+            return self.seq
+
+    def retire(self, seqs):
+        """Marks records as no longer needed and moves the checkpoint past every retired record.
+
+        Once nothing is pending past `wrap_size`, writing starts over at the beginning.
+        """
+        with self.lock:
+            if self.map.closed:
+                # left pending, and replayed on the next start
+                return
+            for seq in seqs:
+                self.offsets.pop(seq, None)
+            if self.offsets:
+                self._set_checkpoint(min(self.offsets.values()))
+                return
+
+            if self.tail < self.wrap_size:
+                self._set_checkpoint(self.tail)
+                return
+            # the end marker goes first, so a crash in between leaves a valid, empty journal either way
+            JOURNAL_RECORD.pack_into(self.map, JOURNAL_HEADER.size, 0, 0, 0, 0)
+            self._set_checkpoint(JOURNAL_HEADER.size)
+            self.tail = JOURNAL_HEADER.size
+
+    def reject(self, seqs):
+        """Moves records the parser rejected to the rejected file, then retires them."""
+        with self.lock:
+            records = [encode_record(seq, *self._read(seq)) for seq in seqs if seq in self.offsets]
+        if records:
+            with open(self.rejected_path, 'ab') as f:
+                f.write(b''.join(records))
+            self.rejected += len(records)
+        self.retire(seqs)
+
+    def _read(self, seq: int) -> tuple[str, bytes]:
+        _, _, _, device, frame = next(iter_records(self.map, self.offsets[seq]))
+        return device, frame
+
+    def replay(self, callback) -> int:
+        """Commits the sessions of the records left pending by the last run, then retires them.
+
+        Frames are parsed one by one, so a rejected frame is moved to the
+        rejected file without holding back the others.
+
+        Args:
+            callback: the ingest callback, saving a `hike.SessionBatch` durably.
+
+        Returns:
+            int: the number of replayed sessions.
+        """
+        batch = hike.SessionBatch()
+        seqs = []
+        rejected = []
+        for offset, _, seq, device, frame in iter_records(self.map, self.checkpoint):
+            with self.lock:
+                self.offsets[seq] = offset
+            try:
+                sessions = protocol.parse_frames([frame])
+            except (AssertionError, ValueError) as e:
+                print(f"Journal: rejected frame {seq} of {device}: {e}")
+                rejected.append(seq)
+                continue
+            sessions.tag(device)
+            batch.extend(sessions)
+            seqs.append(seq)
+
+        if len(batch):
+            callback(batch)
+        self.reject(rejected)
+        self.retire(seqs)
+        return len(batch)
+
+    def sync(self):
+        """Flushes the journal to storage."""
+        with self.lock:
+            self.map.flush()
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "size": len(self.map),
+                "tail": self.tail,
+                "checkpoint": self.checkpoint,
+                "pending": len(self.offsets),
+                "appended": self.appended,
+                "rejected": self.rejected,
+            }
+
+    def close(self):
+        with self.lock:
+            if not self.map.closed:
+                self.map.flush()
+                self.map.close()
+                self.file.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replays the frames of a journal through the parser, for benchmarking.")
+    parser.add_argument("file", nargs="?", default=JOURNAL_FILE_NAME)
+    parser.add_argument("--rejected", action="store_true", help="the file is a rejected file, without a header")
+    parser.add_argument("--repeat", type=int, default=1, help="passes over the frames")
+    parser.add_argument("--batch", type=int, default=64, help="frames parsed per `protocol.parse_frames` call")
+    args = parser.parse_args()
+
+    with open(args.file, 'rb') as f:
+        data = f.read()
+    if args.rejected:
+        frames = [r[4] for r in iter_records(data)]
+    else:
+        # every record still in the file, retired or not
+        frames = [r[4] for r in iter_records(data, JOURNAL_HEADER.size)]
+    size = sum(map(len, frames))
+    print(f"{len(frames)} frames, {size} bytes", file=sys.stderr)
+
+    sessions = points = failures = 0
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        for i in range(0, len(frames), args.batch):
+            chunk = frames[i:i + args.batch]
+            try:
+                batch = protocol.parse_frames(chunk)
+            except (AssertionError, ValueError):
+                # parse the frames of a failing chunk one by one to count the failures
+                for frame in chunk:
+                    try:
+                        batch = protocol.parse_frames([frame])
+                    except (AssertionError, ValueError):
+                        failures += 1
+                        continue
+                    sessions += len(batch)
+                    points += sum(len(c) for c in batch.coords) // 2
+                continue
+            sessions += len(batch)
+            points += sum(len(c) for c in batch.coords) // 2
+    elapsed = time.perf_counter() - start
+
+    print(f"{sessions} sessions, {points} points, {failures} rejected frames in {elapsed:.3f} s: "
+          f"{len(frames) * args.repeat / elapsed if elapsed else 0:.0f} frames/s, "
+          f"{size * args.repeat / elapsed / 1024 / 1024 if elapsed else 0:.1f} MiB/s", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+import threading
+import time
+
+import db
+
+# sessions recorded longer ago than this are moved to the archive
+ARCHIVE_AFTER_DAYS = 365
+# seconds between two maintenance runs
+MAINTENANCE_INTERVAL = 15 * 60
+# seconds without any database write before a maintenance run may start
+IDLE_SECONDS = 120
+# free pages returned to the file system per run, 0 for all
+VACUUM_PAGES = 0
+
+
+class MaintenanceScheduler(threading.Thread):
+    """Background thread archiving old sessions and compacting the database at idle times.
+
+    Every `interval` seconds it checks whether the hub is idle: no database write
+    for `idle_seconds` and no synchronization in progress according to `busy`.
+    If so, it archives the sessions older than `archive_after_days` in small
+    batches, giving way as soon as a synchronization starts, and then runs an
+    incremental vacuum.
+
+    Attributes:
+        hdb: the database to maintain
+        busy: function returning True while a synchronization is in progress
+        runs: number of completed maintenance runs
+        archived: number of sessions archived since start
+        last_run: unix time of the last completed run, 0 if none
+    """
+
+    def __init__(self, hdb: db.HubDatabase, busy=lambda: False, archive_after_days: float = ARCHIVE_AFTER_DAYS,
+                 interval: float = MAINTENANCE_INTERVAL, idle_seconds: float = IDLE_SECONDS):
+        super().__init__(name="maintenance", daemon=True)
+        self.hdb = hdb
+        self.busy = busy
+        self.archive_after_days = archive_after_days
+        self.interval = interval
+        self.idle_seconds = idle_seconds
+
+        self.runs = 0
+        self.archived = 0
+        self.last_run = 0.0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception as e:
+                print(e)
+                print("WARNING: Maintenance run failed.")
+
+    def run_once(self) -> bool:
+        """Runs the archiving and compaction if the hub is idle.
+
+        Returns:
+            bool: whether the run was completed.
+        """
+        if self.busy() or self.hdb.db.idle_for() < self.idle_seconds:
+            return False
+
+        cutoff = time.time() - self.archive_after_days * 24 * 60 * 60
+        while not self._stop_event.is_set():
+            # archived in batches so that a starting synchronization never waits long for the database
+            if self.busy():
+                return False
+            archived = self.hdb.archive(cutoff)
+            self.archived += archived
+            if not archived:
+                break
+
+        if self.busy():
+            return False
+        self.hdb.compact(VACUUM_PAGES)
+
+        self.runs += 1
+        self.last_run = time.time()
+        print(f"Maintenance done, {self.archived} sessions archived so far.")
+        return True
+
+    def stop(self):
+        self._stop_event.set()
+
+    def stats(self) -> dict:
+        return {"runs": self.runs, "archived": self.archived, "last_run": self.last_run}
@@ -0,0 +1,165 @@
+"""Simplified tracks of the sessions, for drawing them on a map.
+
+Every track is simplified once for each zoom level of the web maps, to about a
+pixel at that zoom, and the results are kept on disk as encoded polylines (the
+format of the Google Maps and Leaflet polyline plugins). A map then gets a
+polyline whose length depends on its zoom, not on the length of the track.
+"""
+import json
+import math
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import track
+
+# directory of the simplified tracks, one file per session
+TRACK_CACHE_DIR = 'tracks'
+# zoom levels a track is simplified for; a request of another zoom gets the nearest
+MIN_ZOOM = 8
+MAX_ZOOM = 18
+# tolerance of the simplification, in pixels at the zoom level
+SIMPLIFY_PIXELS = 1.0
+# decimal digits of the encoded coordinates, 5 is about a meter
+POLYLINE_PRECISION = 5
+
+# meters per pixel at the equator at zoom 0, for 256 pixel tiles
+METERS_PER_PIXEL = 2 * math.pi * track.EARTH_RADIUS_M / 256
+
+
+def encode(points, precision: int = POLYLINE_PRECISION) -> str:
+    """Returns a track as an encoded polyline.
+
+    Each coordinate is stored as the zigzag encoded difference to the previous
+    point, in groups of 5 bits, each an ASCII character.
+
+    Args:
+        points: the track, as anything `track.as_array` accepts.
+    """
+    t = track.as_array(points)
+    if not len(t):
+        return ''
+    values = np.round(t * 10 ** precision).astype(np.int64)
+    deltas = np.diff(values, axis=0, prepend=np.zeros((1, 2), dtype=np.int64)).ravel()
+    zigzag = (deltas << 1) ^ (deltas >> 63)
+
+    # every value as up to 7 groups of 5 bits, low bits first, all but its last group flagged by 0x20
+    groups = (zigzag[:, None] >> np.arange(0, 35, 5)) & 0x1f
+    count = np.maximum(1, (np.floor(np.log2(np.maximum(zigzag, 1))).astype(np.int64) + 5) // 5)
+    index = np.arange(7)
+    chars = groups + 63 + 0x20 * (index < count[:, None] - 1)
+    return chars[index < count[:, None]].astype(np.uint8).tobytes().decode('ascii')
+
+
+def zoom_tolerance(zoom: int, latitude: float) -> float:
+    """Returns the simplification tolerance in meters of a track at `latitude` drawn at `zoom`."""
+    return SIMPLIFY_PIXELS * METERS_PER_PIXEL * math.cos(math.radians(latitude)) / 2 ** zoom
+
+
+def simplify_levels(points) -> dict:
+    """Returns the track simplified for every zoom level from `MIN_ZOOM` to `MAX_ZOOM`.
+
+    Returns:
+        dict: [number of points, encoded polyline] by zoom level.
+    """
+    t = track.as_array(points)
+    latitude = float(t[:, 0].mean())
+    # the finest level keeps the most points, the coarser ones are subsets of it
+    tolerances = track.douglas_peucker_tolerances(t, zoom_tolerance(MAX_ZOOM, latitude))
+    levels = {}
+    for zoom in range(MIN_ZOOM, MAX_ZOOM + 1):
+        simplified = t[tolerances > zoom_tolerance(zoom, latitude)]
+        levels[zoom] = [len(simplified), encode(simplified)]
+    return levels
+
+
+class TrackCache:
+    """The simplified tracks of the sessions, in a directory shared by every process of the Hub.
+
+    Tracks are simplified by a background thread as sessions are received, see
+    `submit`, or on the first request of a session that was not, such as an
+    imported one. Files are replaced atomically, so two processes simplifying
+    the same track concurrently only waste work.
+
+    The ids of deleted sessions may be given to new ones, so their files must be
+    removed with `discard`.
+    """
+
+    def __init__(self, path: str = TRACK_CACHE_DIR):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='tracks')
+
+    def _file(self, session_id: int) -> str:
+        return os.path.join(self.path, f"{int(session_id)}.json")
+
+    def build(self, session_id: int, points) -> dict:
+        """Simplifies a track for every zoom level and writes it to the cache.
+
+        Returns:
+            dict: the levels, see `simplify_levels`.
+        """
+        levels = simplify_levels(points)
+        path = self._file(session_id)
+        temp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp, 'w') as f:
+            json.dump({"precision": POLYLINE_PRECISION, "levels": levels}, f, separators=(',', ':'))
+        os.replace(temp, path)
+        return levels
+
+    def submit(self, session_ids, tracks):
+        """Simplifies the tracks of newly received sessions in the background.
+
+        Args:
+            session_ids: the ids of the sessions.
+            tracks: their tracks, as anything `track.as_array` accepts; empty ones are skipped.
+        """
+        jobs = [(int(session_id), points) for session_id, points in zip(session_ids, tracks) if len(points)]
+        if jobs:
+            self.executor.submit(self._build_all, jobs)
+
+    def _build_all(self, jobs):
+        for session_id, points in jobs:
+            # sent again by the watch
+            if not os.path.exists(self._file(session_id)):
+                self.build(session_id, points)
+
+    def get(self, session_id: int, zoom: int, load):
+        """Returns the track of a session simplified for `zoom`, simplifying it first if not cached yet.
+
+        Args:
+            zoom: the zoom level of the map, clamped to `MIN_ZOOM`..`MAX_ZOOM`.
+            load: callable returning the track of the session, see `db.HubDatabase.get_track`.
+
+        Returns:
+            tuple: the zoom level served, the number of points and the encoded polyline.
+            None: if the session has no track.
+        """
+        zoom = max(MIN_ZOOM, min(zoom, MAX_ZOOM))
+        try:
+            with open(self._file(session_id)) as f:
+                levels = json.load(f)["levels"]
+            points, encoded = levels[str(zoom)]
+        except (FileNotFoundError, ValueError, KeyError):
+            # not simplified yet, or for other zoom levels
+            points = load(session_id)
+            if not len(points):
+                return None
+            points, encoded = self.build(session_id, points)[zoom]
+        return zoom, points, encoded
+
+    def discard(self, session_id: int):
+        """Removes the cached track of a deleted session, once its tracks submitted before are written."""
+        self.executor.submit(self._remove, int(session_id))
+
+    def _remove(self, session_id: int):
+        try:
+            os.remove(self._file(session_id))
+        except FileNotFoundError:
+            pass
+
+    def close(self):
+        # tracks not simplified yet are on their first request
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,274 @@
+import re
+import struct
+import sys
+import zlib
+from array import array
+
+import hike
+
+# initial size of the receive buffer, it grows to fit the longest frame
+BUFFER_SIZE = 4096
+# bytes requested from the socket per receive
+RECV_SIZE = 1024
+
+# the coordinates section of a text frame: lat1,long1;lat2,long2;...
+COORDS_PATTERN = re.compile(rb'[^;,]+,[^;,]+(?:;[^;,]+,[^;,]+)*')
+
+# Sent by the Hub on connection: offers protocol v2, then asks for the sessions with `c`.
+# Firmware without v2 support ignores every byte but the `c` and answers with text frames.
+HANDSHAKE = b'v2c'
+# Sent by the Hub once a batch is processed: the `r` makes the watch delete the sessions, and the
+# handshake right after it asks for the next ones instead of waiting for the next reminder.
+ACKNOWLEDGEMENT = b'r' + HANDSHAKE
+
+# Protocol v2 binary frame, all fields little-endian:
+#   header:   magic (u8), version (u8), payload length (u32), low 16 bits of the CRC-32 of these 6 bytes (u16)
+#   payload:  session id (u32), steps (u32), distance in meters (u32), number of points (u32),
+#             then per point latitude and longitude (i32 each) in units of `V2_COORD_SCALE` degrees
+#   trailer:  CRC-32 of the payload (u32)
+# The magic is not ASCII, so it never starts a text frame and both can share a stream.
+# The header has its own checksum, so a corrupted length is caught before waiting for that many bytes.
+V2_MAGIC = 0xB2
+V2_VERSION = 2
+V2_HEADER = struct.Struct('<BBIH')
+V2_BODY = struct.Struct('<IIII')
+V2_TRAILER = struct.Struct('<I')
+V2_COORD_SCALE = 1e-7
+# longest accepted v2 payload, a longer length means the stream is corrupted
+V2_MAX_PAYLOAD = 16 * 1024 * 1024
+# largest session ID, steps and meters of a frame, those of a v2 frame being unsigned 32-bit
+MAX_FIELD = 0xFFFFFFFF
+
+
+class FrameParser:
+    """Incremental parser of the frames sent by the Watch.
+
+    A text frame is in the following format with 0->inf number of latitude and longitude pairs:
+        id;steps;km;lat1,long1;lat2,long2;...;\\n
+
+    A protocol v2 frame is length prefixed binary, see `V2_HEADER`. Both kinds
+    may follow each other in the same stream.
+
+    Received bytes are written straight into a reusable buffer, and frame boundaries
+    are searched in place, so a frame spread over many receives is never copied
+    more than once. The buffer only grows to fit the longest frame seen, and the
+    unfinished tail is moved to its front when it runs out of room.
+
+    The coordinates of all frames of a batch are parsed into one `array('d')`,
+    and each session gets a zero-copy view of its part as `coords`.
+    """
+
+    def __init__(self, size: int = BUFFER_SIZE):
+        self.buffer = bytearray(size)
+        self.start = 0  # first byte not consumed yet
+        self.end = 0  # end of the received bytes
+
+    def _reserve(self, size: int):
+        """Makes room for at least `size` more bytes after `end`."""
+        if len(self.buffer) - self.end >= size:
+            return
+        pending = self.end - self.start
+        if pending + size > len(self.buffer):
+            self.buffer.extend(bytes(max(pending + size, 2 * len(self.buffer)) - len(self.buffer)))
+        self.buffer[:pending] = self.buffer[self.start:self.end]
+        self.start, self.end = 0, pending
+
+    def receive_buffer(self, size: int = RECV_SIZE) -> memoryview:
+        """Returns a writable view of `size` free bytes at the end of the buffer.
+
+        Receive into it, release it, then report the number of written bytes with
+        `received()`. The buffer cannot grow while the view is alive.
+        """
+        self._reserve(size)
+        return memoryview(self.buffer)[self.end:self.end + size]
+
+    def received(self, n: int):
+        """Marks `n` bytes written into the last `receive_buffer()` as received."""
+        self.end += n
+
+    def recv_from(self, sock, size: int = RECV_SIZE) -> int:
+        """Receives up to `size` bytes from `sock` into the buffer.
+
+        Returns:
+            int: the number of received bytes, 0 if the peer closed the connection.
+        """
+        if getattr(sock, 'recv_into', None) is not None:
+            with self.receive_buffer(size) as view:
+                n = sock.recv_into(view)
+        else:
+            data = sock.recv(size)
+            n = len(data)
+            self._reserve(n)
+            self.buffer[self.end:self.end + n] = data
+        self.received(n)
+        return n
+
+    def feed(self, data: bytes):
+        """Appends received bytes to the buffer."""
+        self._reserve(len(data))
+        self.buffer[self.end:self.end + len(data)] = data
+        self.end += len(data)
+
+    @property
+    def pending(self) -> int:
+        """Number of buffered bytes not consumed yet."""
+        return self.end - self.start
+
+    def frames(self) -> list[bytes]:
+        """Consumes and returns the complete frames in the buffer.
+
+        Text frames are returned without their newline, v2 frames whole.
+        """
+        frames = []
+        while self.start < self.end:
+            if self.buffer[self.start] == V2_MAGIC:
+                if self.end - self.start < V2_HEADER.size:
+                    break
+                _, _, length, check = V2_HEADER.unpack_from(self.buffer, self.start)
+                if check != v2_header_check(self.buffer, self.start) or length > V2_MAX_PAYLOAD:
+                    # not a real frame: skip the magic, whatever follows fails to parse as text
+                    self.start += 1
+                    continue
+                size = V2_HEADER.size + length + V2_TRAILER.size
+                if self.end - self.start < size:
+                    break
+                frames.append(bytes(self.buffer[self.start:self.start + size]))
+                self.start += size
+                continue
+
+            newline = self.buffer.find(b'\n', self.start, self.end)
+            if newline < 0:
+                break
+            if newline > self.start:
+                frames.append(bytes(self.buffer[self.start:newline]))
+            self.start = newline + 1
+
+        if self.start == self.end:
+            self.start = self.end = 0
+        return frames
+
+    def sessions(self) -> hike.SessionBatch:
+        """Consumes the complete frames in the buffer and returns their sessions.
+
+        Raises:
+            AssertionError: if a frame misses information, or if it is badly formatted.
+            ValueError: if a number of a frame cannot be parsed, or is out of range.
+        """
+        return parse_frames(self.frames())
+
+
+def v2_header_check(buffer, offset: int = 0) -> int:
+    """Returns the checksum of the v2 header at `offset` of `buffer`, see `V2_HEADER`."""
+    with memoryview(buffer) as view:
+        return zlib.crc32(view[offset:offset + V2_HEADER.size - 2]) & 0xFFFF
+
+
+def parse_frames(frames: list[bytes]) -> hike.SessionBatch:
+    """Parses text frames into a batch of sessions whose tracks are views of one shared array.
+
+    Raises:
+        AssertionError: if a frame misses information, or if it is badly formatted.
+        ValueError: if a number of a frame cannot be parsed, or is out of range.
+    """
+    coords = array('d')
+    headers = []
+    bounds = []
+    for frame in frames:
+        start = len(coords)
+        headers.append(parse_frame(frame, coords))
+        bounds.append((start, len(coords)))
+
+    batch = hike.SessionBatch()
+    # views are only taken once the array stopped growing, as a viewed array cannot be resized
+    with memoryview(coords) as view:
+        for (session_id, steps, km), (start, end) in zip(headers, bounds):
+            batch.append_row((session_id, km, steps, -1, 0), view[start:end])
+    return batch
+
+
+def parse_frame(frame: bytes, coords: array) -> tuple[int, int, float]:
+    """Parses a single text or v2 frame, appending its coordinates to `coords`.
+
+    Returns:
+        tuple: the session ID, steps and km of the frame.
+
+    Raises:
+        AssertionError: if the frame misses information, or if it is badly formatted.
+        ValueError: if a number of the frame cannot be parsed, or is out of range.
+    """
+    if frame[:1] == bytes((V2_MAGIC,)):
+        return parse_v2_frame(frame, coords)
+
+    # the frame may end with a semi-column right before the new-line character
+    parts = frame.rstrip(b'\r\n').rstrip(b';').split(b';', 3)
+    assert len(parts) >= 3 and all(parts[:3]), \
+        f"MessageProcessingError -> The incoming message doesn't contain enough information: {frame!r}"
+
+    session_id, steps, km = int(parts[0]), int(parts[1]), float(parts[2])
+    # larger numbers overflow the arrays of `hike.SessionBatch`, NaN fails every comparison
+    if not (0 <= session_id <= MAX_FIELD and 0 <= steps <= MAX_FIELD and 0 <= km * 1000 <= MAX_FIELD):
+        raise ValueError(f"MessageProcessingError -> Number out of range in the message: {frame!r}")
+
+    if len(parts) > 3:
+        assert COORDS_PATTERN.fullmatch(parts[3]), \
+            f"MessageProcessingError -> Unable to process coordinates: {parts[3]!r}"
+        coords.extend(map(float, parts[3].replace(b';', b',').split(b',')))
+
+    return session_id, steps, km
+
+
+def parse_v2_frame(frame: bytes, coords: array) -> tuple[int, int, float]:
+    """Parses a single v2 frame, appending its coordinates to `coords`.
+
+    Returns:
+        tuple: the session ID, steps and km of the frame.
+
+    Raises:
+        AssertionError: if the frame is truncated or of another version.
+        ValueError: if a checksum of the frame does not match.
+    """
+    assert len(frame) >= V2_HEADER.size + V2_TRAILER.size, \
+        f"MessageProcessingError -> Truncated v2 frame of {len(frame)} bytes"
+    _, version, length, check = V2_HEADER.unpack_from(frame)
+    if check != v2_header_check(frame):
+        raise ValueError("MessageProcessingError -> v2 frame header checksum mismatch")
+    assert version == V2_VERSION, f"MessageProcessingError -> Unsupported protocol version: {version}"
+    assert len(frame) == V2_HEADER.size + length + V2_TRAILER.size and length >= V2_BODY.size, \
+        f"MessageProcessingError -> v2 frame length {length} does not match its {len(frame)} bytes"
+
+    with memoryview(frame) as view:
+        payload = view[V2_HEADER.size:V2_HEADER.size + length]
+        (checksum,) = V2_TRAILER.unpack_from(frame, V2_HEADER.size + length)
+        if zlib.crc32(payload) != checksum:
+            raise ValueError("MessageProcessingError -> v2 frame checksum mismatch")
+
+        session_id, steps, meters, points = V2_BODY.unpack_from(payload)
+        assert V2_BODY.size + 8 * points == length, \
+            f"MessageProcessingError -> v2 frame of {points} points has a payload of {length} bytes"
+
+        fixed = array('i')
+        fixed.frombytes(payload[V2_BODY.size:])
+        if sys.byteorder == 'big':
+            fixed.byteswap()
+        coords.extend([v * V2_COORD_SCALE for v in fixed])
+
+    return session_id, steps, meters / 1000
+
+
+def encode_text_frame(s: hike.HikeSession) -> bytes:
+    """Encodes a session as a text frame, as sent by firmware without v2 support."""
+    points = hike.pack_coords(s.coords)
+    coords = ''.join(f"{points[i]},{points[i + 1]};" for i in range(0, len(points), 2))
+    return f"{s.id};{s.steps};{s.km};{coords}\n".encode()
+
+
+def encode_v2_frame(s: hike.HikeSession) -> bytes:
+    """Encodes a session as a v2 frame."""
+    points = hike.pack_coords(s.coords)
+    fixed = array('i', [round(v / V2_COORD_SCALE) for v in points])
+    if sys.byteorder == 'big':
+        fixed.byteswap()
+    payload = V2_BODY.pack(s.id, s.steps, round(s.km * 1000), len(points) // 2) + fixed.tobytes()
+    header = bytearray(V2_HEADER.pack(V2_MAGIC, V2_VERSION, len(payload), 0))
+    struct.pack_into('<H', header, V2_HEADER.size - 2, v2_header_check(header))
+    return bytes(header) + payload + V2_TRAILER.pack(zlib.crc32(payload))
@@ -1,28 +1,51 @@
-import time
-import sqlite3
+import argparse
+import sys
 
 import hike
 import db
 import bt
+import ingest
+import journal
+import transport
 
 hubdb = db.HubDatabase()
 hubbt = bt.HubBluetooth()
 
-def process_sessions(sessions: list[hike.HikeSession]):
+def process_sessions(sessions: hike.SessionBatch):
     """Callback function to process sessions.
 
     Calculates the calories for a hiking session.
-    Saves the session into the database.
+    Saves the sessions into the database in a single transaction, flushed to
+    storage before returning, as the watch deletes them once acknowledged.
 
     Args:
-        sessions: list of `hike.HikeSession` objects to process
+        sessions: `hike.SessionBatch` of the sessions to process
     """
 
-    for s in sessions:
-        s.calc_kcal()
-        hubdb.save(s)
+    sessions.calc_kcal()
+    hubdb.save_many(sessions, durable=True)
 
 def main():
+    global hubbt
+    parser = argparse.ArgumentParser(description="Standalone receiver saving the sessions of one watch.")
+    parser.add_argument("--transport", choices=transport.TRANSPORTS,
+                        help="reach the watch over a standard socket transport instead of PyBluez")
+    parser.add_argument("--address", default=bt.WATCH_BT_MAC, help="address of the watch on the transport")
+    parser.add_argument("--port", type=int, default=bt.WATCH_BT_PORT, help="port of the watch on the transport")
+    args = parser.parse_args()
+
+    # held until exit, the watches must not be served by a web server meanwhile
+    lock = ingest.IngestLock()
+    if not lock.acquire(blocking=False):
+        sys.exit("Another process is receiving the sessions of the watches (see serve.py), exiting.")
+
+    hubbt = bt.HubBluetooth(transport.get_transport(args.transport) if args.transport else None,
+                            args.address, args.port)
+    hubbt.journal = journal.FrameJournal()
+    replayed = hubbt.journal.replay(process_sessions)
+    if replayed:
+        print(f"Journal: replayed {replayed} sessions received before the last shutdown.")
+
     print("Starting Bluetooth receiver.")
     try:
         while True:
@@ -38,5 +61,8 @@ def main():
         hubbt.sock.close()
         raise e
 
+    finally:
+        hubbt.journal.close()
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
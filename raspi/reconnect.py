@@ -0,0 +1,106 @@
+import random
+import time
+
+import db
+
+# delay after the first failed connection attempt, in seconds
+RECONNECT_MIN_DELAY = 1.0
+# longest delay between two connection attempts, in seconds
+RECONNECT_MAX_DELAY = 60.0
+# growth of the delay with every failed attempt
+RECONNECT_FACTOR = 2.0
+
+
+class ReconnectScheduler:
+    """Spaces out the connection attempts to a watch that is away.
+
+    The delay doubles with every failed attempt, from `min_delay` up to
+    `max_delay`, and a random half of it is dropped so that watches lost at the
+    same time do not keep retrying in step. A successful connection resets it.
+
+    The receivers call `attempted()` before each connection attempt,
+    `failed()` after one fails, to get the delay to wait, and `connected()`
+    once connected.
+
+    Attributes:
+        attempts: connection attempts made
+        failures: connection attempts failed since the last connection
+        presence_checks, absent: presence checks made, and how many did not find the watch
+        time_to_connect: `db.WaitStats` of the time from losing a connection, or
+                         from the first attempt, to the next connection
+    """
+
+    def __init__(self, min_delay: float = RECONNECT_MIN_DELAY, max_delay: float = RECONNECT_MAX_DELAY,
+                 factor: float = RECONNECT_FACTOR, rng: random.Random = None):
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.factor = factor
+        self.random = rng or random.Random()
+        self.attempts = 0
+        self.failures = 0
+        self.connects = 0
+        self.presence_checks = 0
+        self.absent = 0
+        self.delay = 0.0  # last delay handed out
+        self.offline_since = None
+        self.time_to_connect = db.WaitStats()
+
+    @property
+    def should_check_presence(self) -> bool:
+        """Whether to look for the watch before the next attempt: only once an attempt failed,
+        as a watch that just disconnected is most likely still around."""
+        return self.failures > 0
+
+    def attempted(self):
+        if self.offline_since is None:
+            self.offline_since = time.monotonic()
+        self.attempts += 1
+
+    def checked_presence(self, present: bool) -> float:
+        """Records the result of a presence check.
+
+        Returns:
+            float: the seconds to wait before checking again if the watch is absent, 0 otherwise.
+        """
+        self.presence_checks += 1
+        if present:
+            return 0.0
+        self.absent += 1
+        return self.failed()
+
+    def failed(self) -> float:
+        """Records a failed attempt.
+
+        Returns:
+            float: the seconds to wait before the next attempt.
+        """
+        if self.offline_since is None:
+            self.offline_since = time.monotonic()
+        base = min(self.max_delay, self.min_delay * self.factor ** self.failures)
+        self.failures += 1
+        self.delay = self.random.uniform(base / 2, base)
+        return self.delay
+
+    def connected(self):
+        if self.offline_since is not None:
+            self.time_to_connect.record(time.monotonic() - self.offline_since)
+        self.connects += 1
+        self.failures = 0
+        self.delay = 0.0
+        self.offline_since = None
+
+    def disconnected(self):
+        if self.offline_since is None:
+            self.offline_since = time.monotonic()
+
+    def stats(self) -> dict:
+        return {
+            "attempts": self.attempts,
+            "failures": self.failures,
+            "connects": self.connects,
+            "presence_checks": self.presence_checks,
+            "absent": self.absent,
+            "delay_s": round(self.delay, 2),
+            "offline_s": round(time.monotonic() - self.offline_since, 1) if self.offline_since is not None else 0.0,
+            "time_to_connect": self.time_to_connect.snapshot(),
+        }
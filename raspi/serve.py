@@ -0,0 +1,119 @@
+"""Production server of the Hub.
+
+Serves the web app from `WORKERS` gunicorn processes of `THREADS` threads each,
+instead of the single process development server of `wserver.py`. Every worker
+tries to take the `ingest.IngestLock`: exactly one holds it and runs the
+Bluetooth receiver and the database maintenance, the others wait on it and take
+over when the ingesting worker exits, however it exits. Every worker pushes the
+sessions and deletions committed by the others to its own open pages, see
+`wserver.follow_changes`.
+
+On SIGTERM, the workers stop accepting connections, end their event streams so
+the requests in progress can complete, and the ingesting worker stops the
+receiver after the commit in progress, see `wserver.shutdown`.
+
+Usage:
+    python serve.py [--bind 0.0.0.0:5000] [--workers N] [--threads N]
+"""
+import argparse
+import os
+import signal
+import threading
+
+import gunicorn.app.base
+
+BIND = '0.0.0.0:5000'
+# worker processes, one per core
+WORKERS = os.cpu_count() or 1
+# requests served at once by each worker. Every open page holds one for its event
+# stream as long as it is open, so a worker serves a few fewer open pages than this
+# before its other requests wait: keep WORKERS * THREADS well above the pages
+# expected open at once. An idle thread only costs its stack.
+THREADS = 32
+# seconds the requests in progress get to complete on shutdown
+GRACEFUL_TIMEOUT = 10
+
+stopping = threading.Event()
+
+
+def elect_ingest():
+    """Waits until this worker holds the ingest lock, then starts ingesting."""
+    import wserver
+    wserver.ingest_lock.acquire()
+    if stopping.is_set():
+        return
+    print(f"Worker {os.getpid()}: receiving the sessions of the watches.")
+    wserver.start_ingest()
+
+
+def post_worker_init(worker):
+    import wserver
+    # the ingesting worker too, the other workers delete and import sessions
+    threading.Thread(target=wserver.follow_changes, args=(threading.Event(),), daemon=True).start()
+    threading.Thread(target=elect_ingest, daemon=True).start()
+
+    # gunicorn then waits for the requests in progress, which the event streams never complete
+    graceful_exit = signal.getsignal(signal.SIGTERM)
+
+    def handle_exit(sig, frame):
+        stopping.set()
+        threading.Thread(target=wserver.changes.close).start()
+        graceful_exit(sig, frame)
+
+    signal.signal(signal.SIGTERM, handle_exit)
+    signal.siginterrupt(signal.SIGTERM, False)
+
+
+def worker_int(worker):
+    """SIGINT or SIGQUIT, the worker exits right away."""
+    import wserver
+    stopping.set()
+    wserver.shutdown()
+
+
+def worker_exit(server, worker):
+    import wserver
+    stopping.set()
+    wserver.shutdown()
+
+
+class HubApplication(gunicorn.app.base.BaseApplication):
+    """gunicorn serving `wserver.app`, configured from a dict instead of a configuration file."""
+
+    def __init__(self, options: dict):
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        # only imported by the workers, once forked: `wserver` opens the database,
+        # and a SQLite connection must not cross a fork
+        import wserver
+        return wserver.app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serves the Hub with several worker processes, one of which ingests.")
+    parser.add_argument("--bind", default=BIND, help="HOST:PORT or unix:PATH to listen on")
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    parser.add_argument("--threads", type=int, default=THREADS,
+                        help="threads of each worker, one per open page plus a few for the other requests")
+    args = parser.parse_args()
+
+    HubApplication({
+        "bind": args.bind,
+        "workers": args.workers,
+        "threads": args.threads,
+        "worker_class": "gthread",
+        "graceful_timeout": GRACEFUL_TIMEOUT,
+        "post_worker_init": post_worker_init,
+        "worker_int": worker_int,
+        "worker_exit": worker_exit,
+    }).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+"""Simulated watch, to run and load-test the Hub without a Bluetooth adapter.
+
+Listens on a TCP port or a Unix socket and answers the Hub the way the firmware
+does: a `c` received while sessions are stored sends them, and the `r` that
+follows deletes them. Without an `r` within `ACK_TIMEOUT` seconds, the sessions
+are sent again on the next `c`. A `v2` offer before the `c` is answered with
+binary frames, unless --text is given, like firmware without v2 support.
+--lose-acks drops a share of the acknowledgements, as a flaky link would, so the
+sessions are sent again and the Hub must recognize them.
+
+Register the simulated watches with the "tcp" or "unix" transport in
+`watches.DEVICES_FILE_NAME`, or pass --transport to `receiver.py`:
+
+    python simwatch.py --tcp 127.0.0.1:9000 --sessions 1000 --points 500
+    python receiver.py --transport tcp --address 127.0.0.1 --port 9000
+
+When every session is acknowledged, the throughput and the acknowledgement
+latency are printed.
+"""
+import argparse
+import math
+import os
+import random
+import socket
+import sys
+import threading
+import time
+
+import hike
+import protocol
+
+# seconds the firmware waits for the `r` before sending the sessions again
+ACK_TIMEOUT = 2.0
+# sessions sent per `c`, the firmware sends one
+BATCH_SIZE = 1
+# start of the generated tracks
+START_POSITION = (65.0121, 25.4651)
+
+
+def generate_sessions(count: int, points: int, seed: int = 0) -> list[hike.HikeSession]:
+    """Returns `count` sessions with random walk tracks of `points` points, the same for the same seed."""
+    rnd = random.Random(seed)
+    sessions = []
+    for i in range(count):
+        lat, long = START_POSITION
+        coords = []
+        for _ in range(points):
+            lat += rnd.uniform(-1e-4, 1e-4)
+            long += rnd.uniform(-2e-4, 2e-4)
+            coords.append((lat, long))
+        steps = rnd.randint(500, 30000)
+        sessions.append(hike.HikeSession(i + 1, round(steps * 0.00075, 2), steps, coords=coords))
+    return sessions
+
+
+class SimulatedWatch:
+    """Replays the synchronization of the firmware over any stream socket.
+
+    Attributes:
+        pending: the sessions not acknowledged yet
+        v2: whether a v2 offer of the Hub is accepted
+        batch_size: sessions sent per `c`
+        lose_acks: probability of ignoring an `r`
+        acked, bytes_sent, resent: totals over all connections
+        latencies: seconds between sending each batch and receiving its `r`
+    """
+
+    def __init__(self, sessions: list[hike.HikeSession], v2: bool = True, batch_size: int = BATCH_SIZE,
+                 ack_timeout: float = ACK_TIMEOUT, lose_acks: float = 0.0, seed: int = 0):
+        self.pending = list(sessions)
+        self.v2 = v2
+        self.batch_size = batch_size
+        self.ack_timeout = ack_timeout
+        self.lose_acks = lose_acks
+        self.random = random.Random(seed)
+        self.acked = 0
+        self.bytes_sent = 0
+        self.resent = 0
+        self.unacked = 0  # sessions sent whose `r` was lost
+        self.latencies = []
+        self.started = None
+        self.finished = None
+
+    def serve(self, listener: socket.socket):
+        """Accepts connections of the Hub on `listener` until every session is acknowledged."""
+        while self.pending:
+            conn, _ = listener.accept()
+            with conn:
+                self.synchronize(conn)
+        self.finished = time.perf_counter()
+
+    def synchronize(self, conn: socket.socket):
+        """Answers the Hub on one connection, until it closes or every session is acknowledged."""
+        if conn.family in (socket.AF_INET, socket.AF_INET6):
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        conn.settimeout(self.ack_timeout / 4)
+        offered = False
+        previous = None
+        sent = 0  # sessions sent and waiting for their `r`
+        sent_at = 0.0
+        while self.pending:
+            try:
+                data = conn.recv(64)
+            except socket.timeout:
+                data = None
+            except OSError:
+                return
+            if data == b'':
+                return
+
+            if sent and time.perf_counter() - sent_at > self.ack_timeout:
+                sent = 0  # given up, sent again on the next `c`
+
+            for char in data or b'':
+                if previous == ord('v') and char == ord('2'):
+                    offered = True
+                elif char == ord('c') and not sent:
+                    batch = self.pending[:self.batch_size]
+                    encode = protocol.encode_v2_frame if offered and self.v2 else protocol.encode_text_frame
+                    frames = b''.join(encode(s) for s in batch)
+                    if self.started is None:
+                        self.started = time.perf_counter()
+                    conn.sendall(frames)
+                    self.bytes_sent += len(frames)
+                    self.resent += self.unacked
+                    sent = len(batch)
+                    sent_at = time.perf_counter()
+                elif char == ord('r') and sent and self.random.random() < self.lose_acks:
+                    # lost on the way: the same sessions are sent again on the next `c`
+                    self.unacked = sent
+                    sent = 0
+                elif char == ord('r') and sent:
+                    self.latencies.append(time.perf_counter() - sent_at)
+                    del self.pending[:sent]
+                    self.acked += sent
+                    self.unacked = sent = 0
+                previous = char
+
+    def report(self) -> str:
+        elapsed = (self.finished or time.perf_counter()) - (self.started or time.perf_counter())
+        latencies = sorted(self.latencies) or [0.0]
+        percentile = lambda p: latencies[min(len(latencies) - 1, math.ceil(p * len(latencies)) - 1)] * 1000
+        return (f"{self.acked} sessions ({self.resent} sent again), {self.bytes_sent} bytes in {elapsed:.2f} s: "
+                f"{self.acked / elapsed if elapsed else 0:.1f} sessions/s, "
+                f"{self.bytes_sent / elapsed / 1024 if elapsed else 0:.1f} KiB/s, "
+                f"ack latency p50 {percentile(0.5):.1f} ms, p99 {percentile(0.99):.1f} ms, "
+                f"max {latencies[-1] * 1000:.1f} ms")
+
+
+def listen(args, index: int) -> socket.socket:
+    """Returns the listening socket of the `index`th simulated watch: the next port, or the path suffixed by the index."""
+    if args.unix:
+        path = args.unix if args.watches == 1 else f"{args.unix}.{index}"
+        if os.path.exists(path):
+            os.unlink(path)
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(path)
+    else:
+        host, port = args.tcp.rsplit(':', 1)
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind((host, int(port) + index))
+    listener.listen()
+    return listener
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulated watch replaying the synchronization of the firmware.")
+    where = parser.add_mutually_exclusive_group(required=True)
+    where.add_argument("--tcp", metavar="HOST:PORT", help="listen on TCP, further watches on the following ports")
+    where.add_argument("--unix", metavar="PATH", help="listen on a Unix socket, further watches on PATH.1, PATH.2, ...")
+    parser.add_argument("--watches", type=int, default=1, help="number of simulated watches")
+    parser.add_argument("--sessions", type=int, default=100, help="sessions stored on each watch")
+    parser.add_argument("--points", type=int, default=100, help="GPS points per session")
+    parser.add_argument("--batch", type=int, default=BATCH_SIZE, help="sessions sent per `c`")
+    parser.add_argument("--text", action="store_true", help="ignore the v2 offer and send text frames")
+    parser.add_argument("--lose-acks", type=float, default=0.0, metavar="P", help="share of the `r` to ignore")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    sims = []
+    threads = []
+    for i in range(args.watches):
+        sim = SimulatedWatch(generate_sessions(args.sessions, args.points, args.seed + i), v2=not args.text,
+                             batch_size=args.batch, lose_acks=args.lose_acks, seed=args.seed + i)
+        listener = listen(args, i)
+        print(f"Watch {i} listening on {listener.getsockname()}", file=sys.stderr)
+        thread = threading.Thread(target=sim.serve, args=(listener,), daemon=True)
+        thread.start()
+        sims.append(sim)
+        threads.append(thread)
+
+    try:
+        for thread in threads:
+            thread.join()
+    except KeyboardInterrupt:
+        pass
+    for i, sim in enumerate(sims):
+        print(f"Watch {i}: {sim.report()}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
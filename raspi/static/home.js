@@ -0,0 +1,36 @@
+function refreshPage() {
+    window.location.reload();
+}
+
+// Show the hikes added or deleted since the page was rendered, as they are committed
+document.addEventListener('DOMContentLoaded', function() {
+    if (!window.EventSource) {
+        setTimeout(refreshPage, 30000);
+        return;
+    }
+    var feed = new EventSource('/events?last_id=' + encodeURIComponent(PAGE.lastId));
+    feed.addEventListener('reload', refreshPage);
+    feed.addEventListener('sessions', function(e) {
+        var change = JSON.parse(e.data);
+        change.deleted.forEach(function(id) {
+            var card = document.getElementById('session-' + id);
+            if (card) card.remove();
+        });
+        var grid = document.querySelector('.card-grid');
+        var added = change.added.filter(function(s) {
+            // hikes of later pages, or already shown
+            return s.id > PAGE.after && !document.getElementById('session-' + s.id);
+        });
+        if (added.length && !grid) {
+            refreshPage();
+            return;
+        }
+        added.forEach(function(s) {
+            if (grid.children.length < PAGE.limit) grid.insertAdjacentHTML('beforeend', s.html);
+        });
+        Object.keys(change.totals).forEach(function(name) {
+            var total = document.getElementById('total-' + name);
+            if (total) total.textContent = change.totals[name];
+        });
+    });
+});
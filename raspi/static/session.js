@@ -0,0 +1,7 @@
+// Back to the list once this hike is deleted
+if (window.EventSource) {
+    new EventSource('/events').addEventListener('sessions', function(e) {
+        var id = Number(document.body.dataset.sessionId);
+        if (JSON.parse(e.data).deleted.indexOf(id) >= 0) window.location = '/';
+    });
+}
@@ -0,0 +1,264 @@
+import heapq
+import math
+
+import numpy as np
+
+EARTH_RADIUS_M = 6371008.8
+
+# slowest speed still counted as moving, in m/s
+MIN_MOVING_SPEED = 0.3
+# tolerance of `douglas_peucker` in meters
+SIMPLIFY_EPSILON_M = 5.0
+
+
+def as_array(points) -> np.ndarray:
+    """Returns a track as an (n, 2) array of (lat, long) degrees.
+
+    Args:
+        points: the flat doubles lat1, long1, lat2, long2, ... as stored by the database,
+                e.g. an `array('d')` or the view returned by `db.HubDatabase.get_track`,
+                which are wrapped without copying. Anything else is converted.
+    """
+    if isinstance(points, np.ndarray):
+        return points.reshape(-1, 2)
+    if isinstance(points, memoryview):
+        points = points.cast('B')
+    try:
+        return np.frombuffer(points, dtype=np.float64).reshape(-1, 2)
+    except TypeError:
+        return np.asarray(points, dtype=np.float64).reshape(-1, 2)
+
+
+def haversine(lat1, long1, lat2, long2) -> np.ndarray:
+    """Returns the great-circle distances in meters between arrays of points given in degrees."""
+    lat1, long1, lat2, long2 = map(np.radians, (lat1, long1, lat2, long2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((long2 - long1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(a))
+
+
+def segment_distances(track) -> np.ndarray:
+    """Returns the length in meters of each of the n - 1 segments of a track of n points."""
+    t = as_array(track)
+    return haversine(t[:-1, 0], t[:-1, 1], t[1:, 0], t[1:, 1])
+
+
+def distance_km(track) -> float:
+    return float(segment_distances(track).sum()) / 1000
+
+
+def segment_pace(track, times) -> np.ndarray:
+    """Returns the pace of each segment in seconds per km, inf for segments without movement.
+
+    Args:
+        track: the track of n points.
+        times: the n unix times at which the points were recorded.
+    """
+    d = segment_distances(track)
+    dt = np.diff(np.asarray(times, dtype=np.float64))
+    return np.divide(dt * 1000, d, out=np.full_like(d, np.inf), where=d > 0)
+
+
+def moving_time(track, times, min_speed: float = MIN_MOVING_SPEED) -> float:
+    """Returns the seconds spent on segments travelled at `min_speed` m/s or faster."""
+    d = segment_distances(track)
+    dt = np.diff(np.asarray(times, dtype=np.float64))
+    moving = d >= min_speed * dt
+    return float(dt[moving & (dt > 0)].sum())
+
+
+def elevation_gain(elevations, window: int = 5) -> float:
+    """Returns the total ascent in meters of a series of elevations.
+
+    The elevations are first smoothed with a moving average over `window` points,
+    so GPS noise does not add up to phantom climbs.
+    """
+    e = np.asarray(elevations, dtype=np.float64)
+    if len(e) < 2:
+        return 0.0
+    if window > 1 and len(e) >= window:
+        e = np.convolve(e, np.ones(window) / window, mode='valid')
+    rises = np.diff(e)
+    return float(rises[rises > 0].sum())
+
+
+def project(track) -> np.ndarray:
+    """Projects a track to planar (x, y) meters around its mean latitude.
+
+    Accurate enough for the extent of a hike, and much cheaper than geodesics.
+    """
+    t = as_array(track)
+    lat = np.radians(t[:, 0])
+    long = np.radians(t[:, 1])
+    return np.column_stack((EARTH_RADIUS_M * long * np.cos(lat.mean()), EARTH_RADIUS_M * lat))
+
+
+def _segment_distances(p: np.ndarray, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Returns the distances of the points `p` to the segment from `a` to `b`."""
+    ab = b - a
+    length2 = ab @ ab
+    if length2 == 0:
+        return np.hypot(*(p - a).T)
+    t = np.clip(((p - a) @ ab) / length2, 0, 1)
+    return np.hypot(*(p - a - np.outer(t, ab)).T)
+
+
+def douglas_peucker(track, epsilon_m: float = SIMPLIFY_EPSILON_M) -> np.ndarray:
+    """Simplifies a track with the Douglas-Peucker algorithm.
+
+    Every removed point lies within `epsilon_m` meters of the simplified line.
+
+    Returns:
+        np.ndarray: the kept (lat, long) points, always including the first and last.
+    """
+    t = as_array(track)
+    return t[douglas_peucker_tolerances(t, epsilon_m) > epsilon_m]
+
+
+def douglas_peucker_tolerances(track, min_epsilon_m: float = 0.0) -> np.ndarray:
+    """Returns the largest tolerance in meters at which `douglas_peucker` keeps each point of a track.
+
+    `douglas_peucker(track, e)` keeps exactly the points whose tolerance is above
+    `e`, so a track is simplified for several tolerances in a single pass. Points
+    only kept at `min_epsilon_m` or below get 0, the first and last get inf.
+
+    The spans are split level by level: each pass computes the distances of the
+    points of every span still open at once, and splits all of them, so the
+    Python work grows with the depth of the splits, not with the kept points.
+    The numpy work still grows with the points times that depth: a noisy track
+    of 50k points takes about 75 ms, so the tracks are simplified once, off the
+    request paths, see `polyline.TrackCache`.
+    """
+    t = as_array(track)
+    n = len(t)
+    tolerances = np.zeros(n)
+    tolerances[[0, -1]] = np.inf
+    if n < 3:
+        return tolerances
+
+    xy = project(t)
+    x, y = xy[:, 0].copy(), xy[:, 1].copy()
+    # the points of the spans that may still be split, and the kept points their span runs between
+    p = np.arange(1, n - 1)
+    start = np.zeros(n - 2, dtype=np.intp)
+    end = np.full(n - 2, n - 1)
+    while len(p):
+        ax, ay = x[start], y[start]
+        abx, aby = x[end] - ax, y[end] - ay
+        apx, apy = x[p] - ax, y[p] - ay
+        length2 = abx * abx + aby * aby
+        u = np.divide(apx * abx + apy * aby, length2, out=np.zeros(len(p)), where=length2 > 0)
+        np.clip(u, 0, 1, out=u)
+        d2 = (apx - u * abx) ** 2 + (apy - u * aby) ** 2
+
+        # the points of a span are contiguous in `p`; each span is split at its first farthest point
+        first = np.concatenate(([0], np.flatnonzero(start[1:] != start[:-1]) + 1))
+        span = np.repeat(np.arange(len(first)), np.diff(np.append(first, len(p))))
+        farthest = np.maximum.reduceat(d2, first)
+        at_peak = np.flatnonzero(d2 == farthest[span])
+        at_peak = at_peak[np.concatenate(([True], span[at_peak[1:]] != span[at_peak[:-1]]))]
+
+        split = farthest > min_epsilon_m ** 2
+        at_peak = at_peak[split]
+        split_at = p[at_peak]
+        # a point is never kept at a tolerance its parent span was not split at,
+        # the lower of the tolerances of its ends
+        tolerances[split_at] = np.minimum(np.sqrt(farthest[split]),
+                                          np.minimum(tolerances[start[at_peak]], tolerances[end[at_peak]]))
+
+        # the points of the spans not split are settled, the others now run to the split point
+        span_split = np.full(len(first), -1)
+        span_split[split] = split_at
+        point_split = span_split[span]
+        still_open = point_split >= 0
+        still_open[at_peak] = False
+        p, start, end, point_split = p[still_open], start[still_open], end[still_open], point_split[still_open]
+        after = p > point_split
+        start = np.where(after, point_split, start)
+        end = np.where(after, end, point_split)
+
+    return tolerances
+
+
+def _triangle_areas(xy: np.ndarray) -> np.ndarray:
+    """Returns the area of the triangle each inner point forms with its two neighbours."""
+    a, b, c = xy[:-2], xy[1:-1], xy[2:]
+    return np.abs((b[:, 0] - a[:, 0]) * (c[:, 1] - a[:, 1]) - (c[:, 0] - a[:, 0]) * (b[:, 1] - a[:, 1])) / 2
+
+
+def visvalingam(track, min_area_m2: float = SIMPLIFY_EPSILON_M ** 2, max_points: int = None) -> np.ndarray:
+    """Simplifies a track with the Visvalingam-Whyatt algorithm.
+
+    Repeatedly removes the point forming the smallest triangle with its neighbours,
+    until every remaining triangle is at least `min_area_m2` square meters, or
+    while more than `max_points` points remain if given.
+
+    Each removal changes the areas of the neighbours of the removed point, so
+    the removals are a scalar heap loop, taking about 0.7 s for 50k points;
+    only the initial areas are vectorized. Meant for offline use: the
+    request paths simplify with `douglas_peucker_tolerances`.
+
+    Returns:
+        np.ndarray: the kept (lat, long) points, always including the first and last.
+    """
+    t = as_array(track)
+    n = len(t)
+    if n < 3:
+        return t.copy()
+
+    xy = project(t)
+    # the initial areas are vectorized, the updates are scalar and cheaper on plain lists
+    area = [math.inf] + _triangle_areas(xy).tolist() + [math.inf]
+    xs, ys = xy[:, 0].tolist(), xy[:, 1].tolist()
+    prev = list(range(-1, n - 1))
+    nxt = list(range(1, n + 1))
+    removed = np.zeros(n, dtype=bool)
+    remaining = n
+
+    heap = [(area[i], i) for i in range(1, n - 1)]
+    heapq.heapify(heap)
+    while heap:
+        a, i = heapq.heappop(heap)
+        if removed[i] or a != area[i]:
+            continue  # stale entry
+        if max_points is not None:
+            if remaining <= max_points:
+                break
+        elif a >= min_area_m2:
+            break
+
+        removed[i] = True
+        remaining -= 1
+        p, q = prev[i], nxt[i]
+        nxt[p], prev[q] = q, p
+        for j in (p, q):
+            if 0 < j < n - 1:
+                k, l = prev[j], nxt[j]
+                triangle = abs((xs[j] - xs[k]) * (ys[l] - ys[k]) - (xs[l] - xs[k]) * (ys[j] - ys[k])) / 2
+                # a point never gets less significant than the one removed before it
+                area[j] = max(a, triangle)
+                heapq.heappush(heap, (area[j], j))
+
+    return t[~removed]
+
+
+def summary(track, times=None, elevations=None) -> dict:
+    """Returns the analytics of a track available from the given series.
+
+    Args:
+        track: the track of n points.
+        times: optional n unix times of the points, for the pace and moving time.
+        elevations: optional n elevations of the points in meters, for the elevation gain.
+    """
+    t = as_array(track)
+    result = {"points": len(t), "distance_km": round(distance_km(t), 3) if len(t) > 1 else 0.0}
+
+    if times is not None and len(t) > 1:
+        moving = moving_time(t, times)
+        result["duration_s"] = float(times[-1] - times[0])
+        result["moving_time_s"] = moving
+        result["avg_pace_s_per_km"] = round(moving / result["distance_km"], 1) if result["distance_km"] else None
+
+    if elevations is not None:
+        result["elevation_gain_m"] = round(elevation_gain(elevations), 1)
+
+    return result
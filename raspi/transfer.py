@@ -0,0 +1,157 @@
+"""Bulk import and export of hiking sessions as CSV or NDJSON.
+
+Exports are streamed row by row off the database cursor, and imports are
+written in chunks of `IMPORT_CHUNK_SIZE` sessions, each in a single transaction,
+so neither ever holds the whole history in memory.
+
+Usage:
+    python transfer.py export [--format csv|ndjson] [FILE]
+    python transfer.py import [--format csv|ndjson] [--keep-ids] FILE
+"""
+
+import argparse
+import csv
+import io
+import json
+import sys
+
+import db
+import hike
+
+FORMATS = ("csv", "ndjson")
+CSV_HEADER = ["session_id", "km", "steps", "burnt_kcal", "recorded_at", "device"]
+
+# number of sessions written per import transaction
+IMPORT_CHUNK_SIZE = 5000
+
+
+def session_to_dict(s: hike.HikeSession, with_track: bool = False) -> dict:
+    d = {"session_id": s.id, "km": s.km, "steps": s.steps, "burnt_kcal": s.kcal, "recorded_at": s.timestamp,
+         "device": s.device}
+    if with_track:
+        points = hike.pack_coords(s.coords)
+        d["coords"] = [[points[i], points[i + 1]] for i in range(0, len(points), 2)]
+    return d
+
+
+def session_from_dict(d: dict) -> hike.HikeSession:
+    s = hike.from_list([int(d.get("session_id") or 0), float(d["km"]), int(d["steps"]),
+                        float(d.get("burnt_kcal", -1)), int(d.get("recorded_at") or 0), d.get("device") or None])
+    if d.get("coords"):
+        s.coords = d["coords"]
+    return s
+
+
+def export_lines(hdb: db.HubDatabase, fmt: str = "csv"):
+    """Generator yielding the exported sessions, newline terminated, one fetched batch per chunk for CSV.
+
+    NDJSON lines also carry the GPS track of each session under `coords`.
+    """
+    if fmt == "ndjson":
+        for s in hdb.iter_sessions(with_tracks=True):
+            yield json.dumps(session_to_dict(s, with_track=True)) + "\n"
+        return
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(CSV_HEADER)
+    for batch in hdb.iter_batches():
+        writer.writerows(batch.rows())
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def parse_lines(lines, fmt: str = "csv"):
+    """Generator yielding a `hike.HikeSession` for every record of an exported file.
+
+    Args:
+        lines: iterable of text lines, such as an open file.
+        fmt: "csv" or "ndjson".
+
+    Raises:
+        ValueError: if a record is badly formatted.
+    """
+    if fmt == "ndjson":
+        for line in lines:
+            if line.strip():
+                yield session_from_dict(json.loads(line))
+    else:
+        for row in csv.DictReader(lines):
+            yield session_from_dict(row)
+
+
+def import_sessions(hdb: db.HubDatabase, lines, fmt: str = "csv", keep_ids: bool = False,
+                    chunk_size: int = IMPORT_CHUNK_SIZE) -> tuple[int, int]:
+    """Imports sessions from exported lines in chunked transactions.
+
+    Args:
+        hdb: the database to import into.
+        lines: iterable of text lines, such as an open file.
+        fmt: "csv" or "ndjson".
+        keep_ids: keep the exported session IDs, skipping sessions whose ID already
+                  exists, or appeared earlier in the file, instead of appending the
+                  sessions under new IDs.
+        chunk_size: number of sessions written per transaction.
+
+    Returns:
+        tuple[int, int]: the number of imported sessions, and of skipped ones:
+                         IDs already taken with `keep_ids`, or sessions received
+                         from their watch before.
+    """
+    imported = total = 0
+    chunk = hike.SessionBatch()
+    # IDs of the chunk: a repeated one would fail its whole transaction, later
+    # chunks skip the IDs of the earlier ones as already taken
+    chunk_ids = set()
+    for s in parse_lines(lines, fmt):
+        total += 1
+        if keep_ids:
+            if s.id in chunk_ids:
+                continue
+            chunk_ids.add(s.id)
+        chunk.append(s)
+        if len(chunk) >= chunk_size:
+            imported += hdb.save_many(chunk, keep_ids=keep_ids, from_watch=False)
+            chunk = hike.SessionBatch()
+            chunk_ids.clear()
+    imported += hdb.save_many(chunk, keep_ids=keep_ids, from_watch=False)
+    return imported, total - imported
+
+
+def guess_format(path: str) -> str:
+    return "ndjson" if path.endswith((".ndjson", ".jsonl")) else "csv"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk import and export of hiking sessions.")
+    parser.add_argument("command", choices=("export", "import"))
+    parser.add_argument("file", nargs="?", default="-", help="file to read or write, - for stdin/stdout")
+    parser.add_argument("--format", choices=FORMATS, help="defaults to the file extension, or csv")
+    parser.add_argument("--keep-ids", action="store_true", help="import: keep the exported session IDs")
+    parser.add_argument("--db", default=db.DB_FILE_NAME, help="database file")
+    args = parser.parse_args()
+
+    fmt = args.format or guess_format(args.file)
+    hdb = db.HubDatabase(args.db)
+
+    if args.command == "export":
+        out = sys.stdout if args.file == "-" else open(args.file, "w", newline="")
+        try:
+            out.writelines(export_lines(hdb, fmt))
+        finally:
+            if out is not sys.stdout:
+                out.close()
+    else:
+        src = sys.stdin if args.file == "-" else open(args.file, newline="")
+        try:
+            imported, skipped = import_sessions(hdb, src, fmt, keep_ids=args.keep_ids)
+        finally:
+            if src is not sys.stdin:
+                src.close()
+        print(f"Imported {imported} sessions, skipped {skipped}.", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
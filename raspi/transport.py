@@ -0,0 +1,124 @@
+import abc
+import os
+import socket
+
+# seconds a Bluetooth name lookup may take to find a watch
+PRESENCE_TIMEOUT = 3
+
+
+class Transport(abc.ABC):
+    """The kind of link between the Hub and a watch.
+
+    A transport creates unconnected standard library stream sockets and the
+    endpoint to connect them to, so the same receivers run over any of them:
+    blocking (`bt.HubBluetooth`) or driven by an event loop (`aiobt.AsyncHubBluetooth`).
+
+    Attributes:
+        name: the name of the transport in the device registry, see `watches.DEVICES_FILE_NAME`
+    """
+
+    name = None
+
+    @abc.abstractmethod
+    def new_socket(self) -> socket.socket:
+        """Returns a new unconnected stream socket of the transport."""
+
+    def endpoint(self, address: str, port: int):
+        """Returns what the sockets of the transport connect to for a watch at `address` and `port`."""
+        return address, port
+
+    def device_id(self, address: str, port: int) -> str:
+        """Returns the name identifying the watch at `address` and `port`, which its sessions are tagged with."""
+        return address
+
+    def present(self, address: str, port: int) -> bool:
+        """Returns whether the watch at `address` and `port` can be reached, checked more cheaply than by connecting.
+
+        Blocks, up to `PRESENCE_TIMEOUT` seconds. A transport without such a check
+        always returns True.
+        """
+        return True
+
+    def connect(self, address: str, port: int, timeout: float = None) -> socket.socket:
+        """Returns a blocking socket connected to the watch at `address` and `port`.
+
+        Raises:
+            OSError: if the connection fails.
+        """
+        sock = self.new_socket()
+        sock.settimeout(timeout)
+        try:
+            sock.connect(self.endpoint(address, port))
+        except OSError:
+            sock.close()
+            raise
+        return sock
+
+    def __repr__(self):
+        return f"Transport{{{self.name}}}"
+
+
+class RfcommTransport(Transport):
+    """Bluetooth RFCOMM, how the real watch is reached. `address` is its MAC address, `port` its channel."""
+
+    name = 'rfcomm'
+
+    def new_socket(self) -> socket.socket:
+        return socket.socket(socket.AF_BLUETOOTH, socket.SOCK_STREAM, socket.BTPROTO_RFCOMM)
+
+    def present(self, address: str, port: int) -> bool:
+        # a name request only pages the watch, without the RFCOMM and SDP setup of a connection
+        try:
+            import bluetooth
+        except ImportError:
+            return True
+        try:
+            return bluetooth.lookup_name(address, timeout=PRESENCE_TIMEOUT) is not None
+        except bluetooth.btcommon.BluetoothError:
+            return False
+
+
+class TcpTransport(Transport):
+    """TCP, for simulated watches, see `simwatch.py`. `address` is a host name or IP address."""
+
+    name = 'tcp'
+
+    def new_socket(self) -> socket.socket:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        # the acknowledgements are single bytes, they must not wait for more data
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return sock
+
+    def device_id(self, address: str, port: int) -> str:
+        # simulated watches share a host
+        return f"{address}:{port}"
+
+
+class UnixTransport(Transport):
+    """Unix domain socket, for simulated watches on the same machine. `address` is the socket path, `port` is unused."""
+
+    name = 'unix'
+
+    def new_socket(self) -> socket.socket:
+        return socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+    def endpoint(self, address: str, port: int):
+        return address
+
+    def present(self, address: str, port: int) -> bool:
+        return os.path.exists(address)
+
+
+TRANSPORTS = {t.name: t for t in (RfcommTransport(), TcpTransport(), UnixTransport())}
+
+
+def get_transport(name: str) -> Transport:
+    """Returns the transport registered as `name` in `TRANSPORTS`.
+
+    Raises:
+        ValueError: if there is no such transport.
+    """
+    try:
+        return TRANSPORTS[name]
+    except KeyError:
+        raise ValueError(f"Unknown transport {name!r}, expected one of {', '.join(TRANSPORTS)}") from None
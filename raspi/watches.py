@@ -0,0 +1,143 @@
+import asyncio
+import json
+import os
+
+import aiobt
+import bt
+import ingest
+import journal
+import transport
+
+# Registry of the watches served by the Hub, a JSON list such as:
+#   [{"name": "alice", "address": "08:3A:F2:69:AB:CE", "port": 1}, ...]
+# "transport" selects another link than Bluetooth RFCOMM, see `transport.TRANSPORTS`:
+#   {"name": "sim", "address": "127.0.0.1", "port": 9000, "transport": "tcp"}
+# Without the file, the Hub serves the single watch of `bt.WATCH_BT_MAC`.
+DEVICES_FILE_NAME = 'devices.json'
+# connection attempts running at once, an adapter pages one device at a time
+MAX_CONCURRENT_CONNECTS = 1
+
+
+class Device:
+    """A registered watch.
+
+    Attributes:
+        name: display name of the watch
+        address: Bluetooth MAC address of the watch, or its address on `transport`
+        port: RFCOMM channel of the watch, or its port on `transport`
+        transport: name of the transport the watch is reached over, see `transport.TRANSPORTS`
+    """
+
+    def __init__(self, name: str, address: str, port: int = bt.WATCH_BT_PORT, transport: str = 'rfcomm'):
+        self.name = name
+        self.address = address
+        self.port = port
+        self.transport = transport
+
+    @property
+    def id(self) -> str:
+        """The identifier of the watch, which its sessions are tagged with in the database."""
+        return transport.get_transport(self.transport).device_id(self.address, self.port)
+
+    def __repr__(self):
+        return f"Device{{{self.name}, {self.transport}://{self.address}:{self.port}}}"
+
+
+def load_devices(path: str = DEVICES_FILE_NAME) -> list[Device]:
+    """Reads the device registry, see `DEVICES_FILE_NAME`.
+
+    Raises:
+        KeyError: if a device has no address.
+        ValueError: if the file is not valid JSON, a transport is unknown, or a watch is registered twice.
+    """
+    if not os.path.exists(path):
+        return [Device('watch', bt.WATCH_BT_MAC, bt.WATCH_BT_PORT)]
+
+    with open(path) as f:
+        entries = json.load(f)
+    devices = [Device(d.get('name') or d['address'], d['address'], int(d.get('port', bt.WATCH_BT_PORT)),
+                      d.get('transport', 'rfcomm'))
+               for d in entries]
+    ids = [d.id for d in devices]
+    for i in set(ids):
+        if ids.count(i) > 1:
+            raise ValueError(f"Watch {i} is registered more than once in {path}")
+    return devices
+
+
+class WatchManager:
+    """Keeps every registered watch connected, or reconnecting, on one event loop.
+
+    Each watch is served by its own `aiobt.AsyncHubBluetooth`, so a watch that is
+    out of range never holds up the others. Connection attempts share
+    `max_connects` slots, and received batches are committed by `callback`
+    through one `ingest.IngestPipeline`. A watch only acknowledges a batch once
+    it was committed, so a slow database slows the watches down instead of
+    piling their sessions up in memory.
+
+    With a `journal_path`, the received frames are kept in a `journal.FrameJournal`
+    until committed, and the frames left over by a crash are committed first.
+
+    Attributes:
+        devices: the served `Device` objects
+        watches: the `aiobt.AsyncHubBluetooth` of every device, by `Device.id`
+        pipeline: the `ingest.IngestPipeline` writing the received sessions
+        journal: the `journal.FrameJournal` of the received frames, once running
+    """
+
+    def __init__(self, devices: list[Device], callback, max_connects: int = MAX_CONCURRENT_CONNECTS,
+                 journal_path: str = None):
+        self.devices = devices
+        self.max_connects = max_connects
+        self.journal_path = journal_path
+        self.journal = None
+        self.watches = {d.id: aiobt.AsyncHubBluetooth(d.address, d.port, transport.get_transport(d.transport))
+                        for d in devices}
+        self.pipeline = ingest.IngestPipeline(callback)
+
+    async def run(self):
+        """Serves every watch until cancelled."""
+        connect_limit = asyncio.Semaphore(self.max_connects)
+        for watch in self.watches.values():
+            watch.connect_limit = connect_limit
+        try:
+            if self.journal_path:
+                self.journal = journal.FrameJournal(self.journal_path)
+                replayed = await asyncio.get_running_loop().run_in_executor(
+                    self.pipeline.executor, self.journal.replay, self.pipeline.callback)
+                if replayed:
+                    print(f"Journal: replayed {replayed} sessions received before the last shutdown.")
+                for watch in self.watches.values():
+                    watch.journal = self.journal
+            await asyncio.gather(self.pipeline.run(), *(self._serve(d) for d in self.devices))
+        finally:
+            self.close()
+
+    async def _serve(self, device: Device):
+        watch = self.watches[device.id]
+        while True:
+            try:
+                async for sessions in watch:
+                    await self.pipeline.submit(sessions)
+            except Exception as e:
+                print(f"Watch {device.name}: {e}")
+                watch.close()
+                await asyncio.sleep(watch.reconnect.failed())
+
+    @property
+    def connected(self) -> bool:
+        """Whether any watch is currently connected."""
+        return any(w.connected for w in self.watches.values())
+
+    def status(self) -> list[dict]:
+        """Returns the connection state and transfer statistics of every watch, see `aiobt.AsyncHubBluetooth.stats`."""
+        return [{"name": d.name, "id": d.id, "address": d.address, "port": d.port, "transport": d.transport,
+                 **self.watches[d.id].stats()}
+                for d in self.devices]
+
+    def close(self):
+        for watch in self.watches.values():
+            watch.close()
+        self.pipeline.close()
+        if self.journal:
+            self.journal.close()
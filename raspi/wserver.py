@@ -1,87 +1,340 @@
-from flask import Flask, render_template, jsonify, Response, request, redirect, url_for
+from flask import Flask, jsonify, Response, request, redirect, url_for
+import asyncio
+import io
+import json
+import math
 import threading
 import time
 
+import assets
 import db
+import events
 import hike
-import bt
-
-app = Flask(__name__)
+import ingest
+import journal
+import transfer
+import track
+import maintenance
+import polyline
+import watches
+
+# the stylesheets and scripts are only served under their hashed names, see `static_assets`
+app = Flask(__name__, static_folder=None)
 hdb = db.HubDatabase()
 
-bt_thread_running = True
+bt_thread_running = False
+bt_thread = None
+bt_loop = None  # event loop of the Bluetooth thread
+bt_task = None  # main task of `bt_loop`
+
+# held by the one process running the Bluetooth thread, see `start_ingest`
+ingest_lock = ingest.IngestLock()
+
+# maintenance never runs while a watch is connected
+maintenance_scheduler = maintenance.MaintenanceScheduler(hdb, busy=lambda: watch_manager.connected)
+
+# upper bound of the `limit` argument of paginated routes
+MAX_PAGE_SIZE = 500
+
+# rendered dashboard pages kept by (database version, after, limit), and session cards by row
+PAGE_CACHE_SIZE = 16
+CARD_CACHE_SIZE = 1024
+page_cache = db.LRUCache(PAGE_CACHE_SIZE)
+card_cache = db.LRUCache(CARD_CACHE_SIZE)
+
+# tracks of the sessions simplified for the zoom levels of a map, see `/api/sessions/<id>/track`
+track_cache = polyline.TrackCache()
+
+# stylesheets and scripts of the pages, compressed once at startup
+static_assets = assets.AssetStore()
+
+# changes of the sessions pushed to the open pages, see `/events`
+changes = events.ChangeFeed(hdb.version)
+published_version = None  # database version of the last change published by this process
+# seconds between the checks for sessions written by another process, see `follow_changes`
+FOLLOW_INTERVAL = 1.0
 
 
 def process_sessions(sessions):
     """Callback function to process sessions. Use this in synchronize()!
 
     Calculates the calories for a hiking session.
-    Saves the session into the database.
+    Saves the sessions into the database in a single transaction, flushed to
+    storage before returning, as the watches delete them once acknowledged.
 
     Args:
-        sessions: list of `hike.HikeSession` objects to process
+        sessions: `hike.SessionBatch` of the sessions to process
     """
-    for s in sessions:
-        s.calc_kcal()
-        hdb.save(s)
-        print(f"Session saved: {s}")
+    sessions.calc_kcal()
+    saved = hdb.save_many(sessions, durable=True)
+    print(f"{saved} sessions saved, {len(sessions) - saved} already received.")
+    if saved:
+        publish_changes(added=sessions)
+        track_cache.submit(sessions.ids, sessions.coords)
+
+
+def publish_changes(added: hike.SessionBatch = None, deleted: list[int] = (), reload: bool = False,
+                    version: int = None):
+    """Pushes committed sessions and deletions to the open pages, along with the new totals.
+
+    The cards of the added sessions are rendered here once for every client.
+    Sessions a page already shows, such as retransmitted ones, are skipped by the page.
+    With `reload`, the pages are told to load again instead.
+
+    Args:
+        version: the database version the pages are at once they applied the
+                 changes, see `events.ChangeFeed`. Only `follow_changes` knows it,
+                 other writes may have been committed along with those published.
+    """
+    global published_version
+    published_version = hdb.version()
+    if reload:
+        changes.publish('reload', {}, version)
+        return
+    changes.publish('sessions', {
+        "added": [{"id": row[0], "html": render_card(row)} for row in (added.rows() if added else ())],
+        "deleted": [int(i) for i in deleted],
+        "totals": hdb.get_totals(),
+    }, version)
+
+
+def follow_changes(stop: threading.Event, interval: float = FOLLOW_INTERVAL):
+    """Publishes to the pages served by this process the changes committed by another process.
+
+    Runs in every web worker, the ingesting one included, see `serve.py`, until `stop` is set.
+    It makes one query per `interval`, whatever the number of open pages. New
+    sessions are pushed like local ones; other changes, such as deletions or
+    large imports, make the pages reload.
+
+    The events it sends carry the database version they bring the pages to, so a
+    page reconnecting to another process resumes from there, see `events.ChangeFeed`.
+    """
+    version = hdb.version()
+    last_id = hdb.last_session_id()
+    count = hdb.get_totals()['sessions']
+    if version != changes.version:
+        # committed since the feed started, its pages may have missed it
+        publish_changes(reload=True, version=version)
+    while not stop.wait(interval):
+        current = hdb.version()
+        if current == version:
+            continue
+
+        added = hdb.get_sessions_page(last_id, MAX_PAGE_SIZE)
+        totals = hdb.get_totals()
+        if current != published_version:
+            if totals['sessions'] == count + len(added) and len(added) < MAX_PAGE_SIZE:
+                publish_changes(added=added, version=current)
+            else:
+                publish_changes(reload=True, version=current)
+        else:
+            # published by this process as it was committed
+            changes.advance(current)
+        version = current
+        count = totals['sessions']
+        if len(added):
+            last_id = added.ids[-1]
+
+
+watch_manager = watches.WatchManager(watches.load_devices(), process_sessions, journal_path=journal.JOURNAL_FILE_NAME)
 
 
 def bluetooth_thread():
-    """Background thread function for handling Bluetooth connections.
+    """Background thread function running the event loop of the Bluetooth receiver.
 
-    This function continuously tries to connect to the watch device,
-    synchronize data, and process received sessions.
+    All registered watches are served on this one event loop, see `watches.WatchManager`,
+    until `stop_bluetooth_thread()` is called.
     """
+    global bt_loop, bt_task
     print("Starting Bluetooth receiver thread.")
-    hubbt = bt.HubBluetooth()
+    bt_loop = asyncio.new_event_loop()
+    bt_task = bt_loop.create_task(watch_manager.run())
 
     try:
-        while bt_thread_running:
-            try:
-                if not hubbt.sock:
-                    hubbt.wait_for_connection()
-                    print("Thread Connection established.")
-                    hubbt.synchronize(callback=process_sessions)
-                    print("Synchronization performed.")
-            except Exception as e:
-                time.sleep(5)
-
-                if hubbt.sock:
-                    try:
-                        hubbt.sock.close()
-                    except:
-                        pass
-
-                hubbt = bt.HubBluetooth()
-
-    except KeyboardInterrupt:
+        bt_loop.run_until_complete(bt_task)
+
+    except asyncio.CancelledError:
         print("Bluetooth thread shutting down...")
 
     except Exception as e:
         print(e)
 
     finally:
-        if hubbt.sock:
-            try:
-                hubbt.sock.close()
-            except:
-                pass
+        # ends the receivers, which retire the journal records of their uncommitted batches
+        bt_loop.run_until_complete(bt_loop.shutdown_asyncgens())
+        watch_manager.close()
+        bt_loop.close()
         print("Bluetooth thread ended.")
 
 
+def stop_bluetooth_thread():
+    global bt_thread_running
+    bt_thread_running = False
+    if bt_loop is not None and not bt_loop.is_closed():
+        bt_loop.call_soon_threadsafe(bt_task.cancel)
+
+
+def start_ingest():
+    """Starts the Bluetooth thread and the database maintenance in this process.
+
+    Only the process holding `ingest_lock` may call it, so that each watch is
+    served by a single receiver.
+    """
+    global bt_thread, bt_thread_running
+    bt_thread_running = True
+    bt_thread = threading.Thread(target=bluetooth_thread, daemon=True)
+    bt_thread.start()
+    maintenance_scheduler.start()
+
+
+def shutdown(timeout: float = 5):
+    """Ends the event streams, then the ingest if this process runs it.
+
+    The batch being committed is finished; the watches were not acknowledged for
+    it nor for the others in flight, and send them again on the next connection.
+    """
+    changes.close()
+    if bt_thread is not None:
+        stop_bluetooth_thread()
+        maintenance_scheduler.stop()
+        bt_thread.join(timeout=timeout)
+    track_cache.close()
+    ingest_lock.release()
+
+
+def page_args() -> tuple[int, int]:
+    """Reads the `after` and `limit` keyset pagination arguments of the current request."""
+    after = request.args.get('after', 0, type=int)
+    limit = request.args.get('limit', db.DB_PAGE_SIZE, type=int)
+    return after, max(1, min(limit, MAX_PAGE_SIZE))
+
+
 @app.route('/api/')
 def get_home_api():
-    sessions = hdb.get_sessions()
-    return render_template('home.html', sessions=sessions)
+    after, limit = page_args()
+    sessions = hdb.get_sessions_page(after, limit)
+    return jsonify(list(sessions.rows()))
 
 
 @app.route('/api/sessions')
 def get_sessions_api():
-    sessions = hdb.get_sessions()
-    sessions = list(map(lambda s: hike.to_list(s), sessions))
-    print(sessions)
-    return jsonify(sessions)
+    """Returns the sessions as JSON.
+
+    With an `after` or `limit` argument a single page is returned as a list.
+    Otherwise the whole history is streamed straight off the database cursor, as
+    a list, or one session per line with `?format=ndjson` or an `Accept:
+    application/x-ndjson` header. Streams take `since`, a unix time, to only
+    return the sessions recorded from then on, and `fields`, a comma separated
+    subset of `db.SESSION_FIELDS` to return in that order.
+
+    Every response carries the database version as its ETag and the time of the
+    last change as its Last-Modified, so a client polling with If-None-Match or
+    If-Modified-Since gets a `304 Not Modified` until the sessions change.
+    """
+    # read before the sessions, a change in between is then seen on the next request
+    change = hdb.last_change()
+    if 'after' in request.args or 'limit' in request.args:
+        after, limit = page_args()
+        return versioned(jsonify(list(hdb.get_sessions_page(after, limit).rows())), change)
+
+    ndjson = (request.args.get('format') == 'ndjson' or request.accept_mimetypes.best_match(
+        ['application/json', 'application/x-ndjson']) == 'application/x-ndjson')
+    fields = request.args.get('fields')
+    fields = tuple(fields.split(',')) if fields else db.SESSION_FIELDS
+    if not set(fields) <= set(db.SESSION_FIELDS):
+        return Response(f"Unknown fields: {', '.join(set(fields) - set(db.SESSION_FIELDS))}", status=400)
+    since = request.args.get('since')
+    if since is not None:
+        try:
+            since = float(since)
+        except ValueError:
+            since = math.nan
+        if not math.isfinite(since):
+            return Response(f"Invalid since: {request.args['since']}", status=400)
+    batches = hdb.iter_json(fields, since=since)
+
+    def generate_ndjson():
+        for rows in batches:
+            yield '\n'.join(rows) + '\n'
+
+    def generate_json():
+        separator = '['
+        for rows in batches:
+            yield separator + ','.join(rows)
+            separator = ','
+        yield ']' if separator == ',' else '[]'
+
+    if ndjson:
+        return versioned(Response(generate_ndjson(), mimetype='application/x-ndjson'), change, 'ndjson')
+    return versioned(Response(generate_json(), mimetype='application/json'), change)
+
+
+def versioned(response: Response, change: tuple[int, float], variant: str = None) -> Response:
+    """Tags a response listing sessions with the database version and the time of its last change.
+
+    Args:
+        change: `db.HubDatabase.last_change` read before the sessions of the response.
+
+    Returns:
+        Response: `response`, or a `304 Not Modified` if the copy of the client is current.
+    """
+    version, changed_at = change
+    response.set_etag(f"{version}-{variant}" if variant else str(version))
+    # a later change within the same second would otherwise leave the Last-Modified of a copy unchanged
+    if int(changed_at) < int(time.time()):
+        response.last_modified = int(changed_at)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.vary.add('Accept')
+    # or computing the Content-Length would buffer a streamed body
+    response.implicit_sequence_conversion = False
+    return response.make_conditional(request)
+
+
+@app.route('/api/export')
+def export_api():
+    """Streams every session as a CSV (default) or NDJSON (`?format=ndjson`) file."""
+    fmt = request.args.get('format', 'csv')
+    if fmt not in transfer.FORMATS:
+        return Response(f"Unknown format: {fmt}", status=400)
+
+    mimetype = 'application/x-ndjson' if fmt == 'ndjson' else 'text/csv'
+    return Response(transfer.export_lines(hdb, fmt), mimetype=mimetype,
+                    headers={"Content-Disposition": f"attachment; filename=sessions.{fmt}"})
+
+
+@app.route('/api/import', methods=['POST'])
+def import_api():
+    """Imports a CSV (default) or NDJSON (`?format=ndjson`) file posted as the request body.
+
+    With `?keep_ids=1` the exported session IDs are kept, otherwise the sessions are appended.
+    Returns the number of imported sessions, and of those skipped as already present.
+    """
+    fmt = request.args.get('format', 'csv')
+    if fmt not in transfer.FORMATS:
+        return Response(f"Unknown format: {fmt}", status=400)
+
+    lines = io.TextIOWrapper(request.stream, encoding='utf-8', newline='')
+    try:
+        imported, skipped = transfer.import_sessions(hdb, lines, fmt,
+                                                     keep_ids=request.args.get('keep_ids', 0, type=int) == 1)
+    except (KeyError, ValueError) as e:
+        return Response(f"Malformed import file: {e}", status=400)
+
+    if imported:
+        # too many cards to push, the pages load them again
+        publish_changes(reload=True)
+    return jsonify({"imported": imported, "skipped": skipped})
+
+
+@app.route('/api/stats')
+def get_stats_api():
+    """Returns the all-time totals and the latest daily and weekly rollups of km, steps and kcal."""
+    limit = max(1, min(request.args.get('limit', 30, type=int), MAX_PAGE_SIZE))
+    return jsonify({
+        "all": hdb.get_totals(),
+        "daily": hdb.get_rollups("day", limit),
+        "weekly": hdb.get_rollups("week", limit),
+    })
 
 
 @app.route('/api/sessions/<id>')
@@ -90,280 +343,114 @@ def get_session_by_id_api(id):
     return jsonify(hike.to_list(session))
 
 
+@app.route('/api/sessions/<id>/analytics')
+def get_session_analytics_api(id):
+    """Returns the GPS distance and point count of a session's track, next to the watch's own estimate."""
+    session = hdb.get_session(id)
+    result = track.summary(hdb.get_track(session.id))
+    result["watch_km"] = session.km
+    return jsonify(result)
+
+
+@app.route('/api/sessions/<int:id>/track')
+def get_session_track_api(id):
+    """Returns the track of a session as an encoded polyline, simplified for the map zoom level `zoom`.
+
+    The polylines are simplified once per session, when it is received, and kept
+    on disk, see `polyline.TrackCache`; without `zoom` the most detailed one is returned.
+    """
+    zoom = request.args.get('zoom', polyline.MAX_ZOOM, type=int)
+    result = track_cache.get(id, zoom, hdb.get_track)
+    if result is None:
+        return Response("No track", status=404)
+    zoom, points, encoded = result
+    response = jsonify({"session_id": id, "zoom": zoom, "points": points,
+                        "precision": polyline.POLYLINE_PRECISION, "polyline": encoded})
+    response.add_etag()
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
+
 @app.route('/api/sessions/<id>/delete')
 def delete_session_api(id):
     hdb.delete(id)
+    track_cache.discard(id)
+    publish_changes(deleted=[id])
     print(f'DELETED SESSION WITH ID: {id}')
     return Response(status=202)
 
+
+@app.route('/events')
+def events_stream():
+    """Server-Sent Events stream of the added and deleted sessions, see `events.ChangeFeed`.
+
+    `?last_id=` is the id of the feed the page was rendered at; a reconnecting
+    browser sends the id of the last event it received in `Last-Event-ID` instead.
+    """
+    last_id = request.headers.get('Last-Event-ID') or request.args.get('last_id')
+    return Response(changes.stream(last_id), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route(assets.ASSETS_URL + '<name>')
+def get_asset(name):
+    """Stylesheets and scripts of the pages, by the hashed names of `static_assets.url`."""
+    response = static_assets.respond(name, request)
+    if response is None:
+        return Response("Not found", status=404)
+    return response
+
+
+@app.after_request
+def compress(response):
+    return assets.compress_response(response, request)
+
+
 @app.route('/')
 def home():
-    sessions = hdb.get_sessions()
-    sessions = list(map(lambda s: hike.to_list(s), sessions))
+    """Dashboard showing the totals and a page of sessions.
 
-    html = """
+    The rendered page is compressed and cached under the database version, see `db.HubDatabase.version`,
+    and sent with an ETag of its content: a browser polling an unchanged database
+    gets a `304 Not Modified`, and nothing is rendered again.
+
+    Once loaded, the page follows `/events` to show new and deleted sessions without reloading.
+    """
+    after, limit = page_args()
+    # read before the sessions, so the page gets every event of a change it may not show yet
+    seq = changes.seq
+    key = (hdb.version(), after, limit)
+    page = page_cache.get(key)
+    if page is None:
+        page_cache.invalidate_if(lambda k, _: k[0] != key[0])
+        # at the version the page is cached under, which the feed may not have reached yet
+        last_id = changes.event_id(seq, key[0])
+        page = assets.Precompressed(render_home(after, limit, last_id).encode())
+        page_cache.put(key, page)
+
+    response = page.respond(request, 'text/html')
+    # cached by the browser, but revalidated on every load
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
+
+def render_home(after: int, limit: int, last_id: str) -> str:
+    sessions = list(hdb.get_sessions_page(after, limit).rows())
+
+    html = f"""
     <!DOCTYPE html>
     <html>
     <head>
         <title>ESD-Hike Tracker</title>
         <meta name="viewport" content="width=device-width, initial-scale=1">
-        <style>
-            * {
-                box-sizing: border-box;
-                font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
-            }
-            body {
-                margin: 0;
-                padding: 20px;
-                background-color: #f8f9fa;
-                color: #212529;
-            }
-            h1, h2 {
-                color: #2c3e50;
-                text-align: left;
-            }
-            h1 {
-                margin-bottom: 0;
-            }
-            .tagline {
-                text-align: center;
-                color: #7f8c8d;
-                margin-top: 5px;
-                margin-bottom: 30px;
-            }
-            .container {
-                max-width: 1200px;
-                margin: 0 auto;
-            }
-            .card-grid {
-                display: grid;
-                grid-template-columns: repeat(auto-fill, minmax(280px, 1fr));
-                gap: 20px;
-            }
-            .card {
-                background: white;
-                border-radius: 12px;
-                overflow: hidden;
-                box-shadow: 0 4px 12px rgba(0,0,0,0.1);
-                transition: transform 0.3s ease, box-shadow 0.3s ease;
-            }
-            .card:hover {
-                transform: translateY(-5px);
-                box-shadow: 0 10px 20px rgba(0,0,0,0.15);
-            }
-            .card-header {
-                background: linear-gradient(135deg, #3498db, #2980b9);
-                color: white;
-                padding: 15px;
-                font-weight: bold;
-                font-size: 0.9em;
-                display: flex;
-                justify-content: space-between;
-            }
-            .session-id {
-                opacity: 0.7;
-                font-size: 0.8em;
-            }
-            .card-body {
-                padding: 20px;
-                display: flex;
-                flex-direction: column;
-                align-items: center;
-            }
-            .stat-grid {
-                display: grid;
-                grid-template-columns: 1fr 1fr;
-                gap: 15px;
-                width: 100%;
-                margin-bottom: 15px;
-            }
-            .stat-box {
-                background: #f8f9fa;
-                border-radius: 8px;
-                padding: 10px;
-                text-align: center;
-            }
-            .stat-value {
-                font-size: 1.8em;
-                font-weight: bold;
-                color: #2c3e50;
-                margin: 5px 0;
-            }
-            .stat-label {
-                font-size: 0.8em;
-                color: #7f8c8d;
-                text-transform: uppercase;
-            }
-            .progress-container {
-                width: 120px;
-                height: 120px;
-                position: relative;
-                margin: 0 auto;
-            }
-            .progress-circle-bg {
-                width: 100%;
-                height: 100%;
-                border-radius: 50%;
-                border: 10px solid #e9ecef;
-                box-sizing: border-box;
-            }
-            .progress-circle {
-                position: absolute;
-                top: 0;
-                left: 0;
-            }
-            .progress-circle-value {
-                position: absolute;
-                top: 50%;
-                left: 50%;
-                transform: translate(-50%, -50%);
-                font-size: 1.5em;
-                font-weight: bold;
-                color: #2c3e50;
-            }
-            .card-footer {
-                display: flex;
-                border-top: 1px solid #e9ecef;
-            }
-            .card-action {
-                flex: 1;
-                padding: 10px;
-                text-align: center;
-                text-decoration: none;
-                color: #2c3e50;
-                font-weight: bold;
-                transition: background-color 0.3s;
-            }
-            .card-action:hover {
-                background-color: #f8f9fa;
-            }
-            .card-action.delete {
-                color: #e74c3c;
-            }
-            .card-action.view {
-                color: #3498db;
-            }
-            .add-form-container {
-                background: white;
-                border-radius: 12px;
-                box-shadow: 0 4px 12px rgba(0,0,0,0.1);
-                padding: 20px;
-                margin-bottom: 30px;
-                max-width: 500px;
-                background-color: #FFEFEF;
-            }
-            .form-title {
-                color: #2c3e50;
-                margin-top: 0;
-                margin-bottom: 20px;
-                text-align: left;
-            }
-            .form-grid {
-                display: grid;
-                grid-template-columns: 1fr 1fr;
-                gap: 15px;
-            }
-            .form-group {
-                margin-bottom: 15px;
-            }
-            label {
-                display: block;
-                margin-bottom: 5px;
-                font-weight: bold;
-                color: #2c3e50;
-            }
-            input {
-                width: 100%;
-                padding: 10px;
-                border: 1px solid #ddd;
-                border-radius: 5px;
-                font-size: 1em;
-            }
-            .btn {
-                display: inline-block;
-                background: #3498db;
-                color: white;
-                border: none;
-                padding: 12px 20px;
-                border-radius: 5px;
-                cursor: pointer;
-                font-size: 1em;
-                font-weight: bold;
-                transition: background-color 0.3s;
-                width: 100%;
-            }
-            .btn:hover {
-                background: #2980b9;
-            }
-            .no-sessions {
-                text-align: center;
-                padding: 50px;
-                background: white;
-                border-radius: 12px;
-                box-shadow: 0 4px 12px rgba(0,0,0,0.1);
-            }
-            .full-width {
-                grid-column: 1 / -1;
-            }
-            .bt-status {
-                background: #e9ecef;
-                border-radius: 12px;
-                padding: 10px 15px;
-                margin-bottom: 20px;
-                display: flex;
-                align-items: center;
-                font-size: 0.9em;
-            }
-            .bt-status-indicator {
-                width: 12px;
-                height: 12px;
-                border-radius: 50%;
-                margin-right: 10px;
-            }
-            .bt-status-active {
-                background-color: #2ecc71;
-            }
-            .bt-status-inactive {
-                background-color: #e74c3c;
-            }
-            .refresh-btn {
-                background: #3498db;
-                color: white;
-                border: none;
-                padding: 8px 15px;
-                border-radius: 5px;
-                cursor: pointer;
-                font-size: 0.9em;
-                margin-left: auto;
-                transition: background-color 0.3s;
-            }
-            .refresh-btn:hover {
-                background: #2980b9;
-            }
-
-            @media (max-width: 768px) {
-                .form-grid {
-                    grid-template-columns: 1fr;
-                }
-            }
-        </style>
-        <script>
-            // Auto refresh the page every 30 seconds to show new hikes
-            setTimeout(function() {
-                window.location.reload();
-            }, 30000);
-
-            function refreshPage() {
-                window.location.reload();
-            }
-        </script>
+        <link rel="stylesheet" href="{static_assets.url('home.css')}">
+        <script src="{static_assets.url('home.js')}" defer></script>
     </head>
     <body>
         <div class="container">
             <h1>ESD-Hike Tracker</h1>
             <div class="bt-status">
                 <div class="bt-status-indicator bt-status-active"></div>
-                <span>Bluetooth Receiver Active - Auto-refreshing every 30 seconds</span>
+                <span>Bluetooth Receiver Active - New hikes appear as they are received</span>
                 <button class="refresh-btn" onclick="refreshPage()">Refresh Now</button>
             </div>
             <br>
@@ -393,6 +480,28 @@ def home():
             <h2>Your Hikes</h2>
     """
 
+    totals = hdb.get_totals()
+    html += f"""
+            <div class="stat-grid totals">
+                <div class="stat-box">
+                    <div class="stat-value" id="total-sessions">{totals['sessions']}</div>
+                    <div class="stat-label">Hikes</div>
+                </div>
+                <div class="stat-box">
+                    <div class="stat-value" id="total-km">{totals['km']}</div>
+                    <div class="stat-label">Kilometers</div>
+                </div>
+                <div class="stat-box">
+                    <div class="stat-value" id="total-steps">{totals['steps']}</div>
+                    <div class="stat-label">Steps</div>
+                </div>
+                <div class="stat-box">
+                    <div class="stat-value" id="total-kcal">{totals['kcal']}</div>
+                    <div class="stat-label">Calories (kcal)</div>
+                </div>
+            </div>
+    """
+
     if not sessions:
         html += """
             <div class="no-sessions">
@@ -405,64 +514,25 @@ def home():
             <div class="card-grid">
         """
 
-        for session in sessions:
-            # Calculate progress percentage based on steps (10000 steps is considered a full day)
-            step_percentage = min(session[2] / 10000 * 100, 100)
-            circle_color = "#3498db"
-
-            # Change color based on percentage
-            if step_percentage >= 100:
-                circle_color = "#27ae60"  # Green for 100%+
-            elif step_percentage >= 75:
-                circle_color = "#2ecc71"  # Light green for 75%+
-            elif step_percentage >= 50:
-                circle_color = "#f39c12"  # Orange for 50%+
-            elif step_percentage >= 25:
-                circle_color = "#e67e22"  # Light orange for 25%+
-            else:
-                circle_color = "#e74c3c"  # Red for <25%
-
-            card_html = f"""
-            <div class="card">
-                <div class="card-header">
-                    <span>Hike #{session[0]}</span>
-                </div>
-                <div class="card-body">
-                    <div class="stat-grid">
-                        <div class="stat-box">
-                            <div class="stat-value">{session[1]}</div>
-                            <div class="stat-label">Kilometers</div>
-                        </div>
-                        <div class="stat-box">
-                            <div class="stat-value">{session[3]}</div>
-                            <div class="stat-label">Calories (kcal)</div>
-                        </div>
-                    </div>
-
-                    <div class="progress-container">
-                        <div class="progress-circle-bg"></div>
-                        <svg class="progress-circle" width="120" height="120" viewBox="0 0 120 120">
-                            <circle cx="60" cy="60" r="54" fill="none" stroke="{circle_color}" stroke-width="12" 
-                                    stroke-dasharray="{3.4 * min(step_percentage, 100)}, 339.5" />
-                        </svg>
-                        <div class="progress-circle-value">{session[2]}</div>
-                    </div>
-                    <div class="stat-label" style="margin-top: 5px;">Steps</div>
-                </div>
-                <div class="card-footer">
-                    <a href="/view_session/{session[0]}" class="card-action view">View Details</a>
-                    <a href="/delete_session/{session[0]}" class="card-action delete">Delete</a>
-                </div>
-            </div>
-            """
-            html += card_html
+        html += ''.join(render_card(session) for session in sessions)
 
         html += """
             </div>
         """
 
-    html += """
+    if after or len(sessions) == limit:
+        html += '<div class="pager">'
+        if after:
+            html += '<a href="/" class="card-action">First Page</a>'
+        if len(sessions) == limit:
+            html += f'<a href="/?after={sessions[-1][0]}&limit={limit}" class="card-action">Next Page</a>'
+        html += '</div>'
+
+    html += f"""
         </div>
+        <script>
+            var PAGE = {json.dumps({"lastId": last_id, "after": after, "limit": limit})};
+        </script>
     </body>
     </html>
     """
@@ -470,6 +540,65 @@ def home():
     return html
 
 
+def render_card(session: tuple) -> str:
+    """Returns the dashboard card of a session row, rendered once per distinct row."""
+    card = card_cache.get(session)
+    if card is not None:
+        return card
+
+    # Calculate progress percentage based on steps (10000 steps is considered a full day)
+    step_percentage = min(session[2] / 10000 * 100, 100)
+    circle_color = "#3498db"
+
+    # Change color based on percentage
+    if step_percentage >= 100:
+        circle_color = "#27ae60"  # Green for 100%+
+    elif step_percentage >= 75:
+        circle_color = "#2ecc71"  # Light green for 75%+
+    elif step_percentage >= 50:
+        circle_color = "#f39c12"  # Orange for 50%+
+    elif step_percentage >= 25:
+        circle_color = "#e67e22"  # Light orange for 25%+
+    else:
+        circle_color = "#e74c3c"  # Red for <25%
+
+    card = f"""
+    <div class="card" id="session-{session[0]}">
+        <div class="card-header">
+            <span>Hike #{session[0]}</span>
+        </div>
+        <div class="card-body">
+            <div class="stat-grid">
+                <div class="stat-box">
+                    <div class="stat-value">{session[1]}</div>
+                    <div class="stat-label">Kilometers</div>
+                </div>
+                <div class="stat-box">
+                    <div class="stat-value">{session[3]}</div>
+                    <div class="stat-label">Calories (kcal)</div>
+                </div>
+            </div>
+
+            <div class="progress-container">
+                <div class="progress-circle-bg"></div>
+                <svg class="progress-circle" width="120" height="120" viewBox="0 0 120 120">
+                    <circle cx="60" cy="60" r="54" fill="none" stroke="{circle_color}" stroke-width="12" 
+                            stroke-dasharray="{3.4 * min(step_percentage, 100)}, 339.5" />
+                </svg>
+                <div class="progress-circle-value">{session[2]}</div>
+            </div>
+            <div class="stat-label" style="margin-top: 5px;">Steps</div>
+        </div>
+        <div class="card-footer">
+            <a href="/view_session/{session[0]}" class="card-action view">View Details</a>
+            <a href="/delete_session/{session[0]}" class="card-action delete">Delete</a>
+        </div>
+    </div>
+    """
+    card_cache.put(session, card)
+    return card
+
+
 @app.route('/view_session/<id>')
 def view_session(id):
     session = hdb.get_session(int(id))
@@ -497,140 +626,10 @@ def view_session(id):
     <head>
         <title>Hike Details</title>
         <meta name="viewport" content="width=device-width, initial-scale=1">
-        <style>
-            * {{
-                box-sizing: border-box;
-                font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
-            }}
-            body {{
-                margin: 0;
-                padding: 20px;
-                background-color: #f8f9fa;
-                color: #212529;
-            }}
-            h1 {{
-                color: #2c3e50;
-                text-align: center;
-                margin-bottom: 30px;
-            }}
-            .container {{
-                max-width: 800px;
-                margin: 0 auto;
-            }}
-            .detail-card {{
-                background: white;
-                border-radius: 12px;
-                overflow: hidden;
-                box-shadow: 0 4px 12px rgba(0,0,0,0.1);
-            }}
-            .card-header {{
-                background: linear-gradient(135deg, #3498db, #2980b9);
-                color: white;
-                padding: 20px;
-                font-size: 1.2em;
-                text-align: center;
-            }}
-            .session-id {{
-                opacity: 0.7;
-                font-size: 0.8em;
-                display: block;
-                margin-top: 5px;
-            }}
-            .card-body {{
-                padding: 30px;
-            }}
-            .stat-grid {{
-                display: grid;
-                grid-template-columns: repeat(auto-fit, minmax(200px, 1fr));
-                gap: 20px;
-                margin-bottom: 30px;
-            }}
-            .stat-box {{
-                background: #f8f9fa;
-                border-radius: 8px;
-                padding: 20px;
-                text-align: center;
-            }}
-            .stat-value {{
-                font-size: 2.5em;
-                font-weight: bold;
-                color: #2c3e50;
-                margin: 10px 0;
-            }}
-            .stat-label {{
-                font-size: 0.9em;
-                color: #7f8c8d;
-                text-transform: uppercase;
-            }}
-            .progress-container {{
-                width: 200px;
-                height: 200px;
-                position: relative;
-                margin: 0 auto 30px auto;
-            }}
-            .progress-circle-bg {{
-                width: 100%;
-                height: 100%;
-                border-radius: 50%;
-                border: 15px solid #e9ecef;
-                box-sizing: border-box;
-            }}
-            .progress-circle {{
-                position: absolute;
-                top: 0;
-                left: 0;
-            }}
-            .progress-circle-value {{
-                position: absolute;
-                top: 50%;
-                left: 50%;
-                transform: translate(-50%, -50%);
-                font-size: 2.5em;
-                font-weight: bold;
-                color: #2c3e50;
-            }}
-            .progress-label {{
-                display: block;
-                text-align: center;
-                margin-top: 8px;
-                font-size: 0.9em;
-                color: #7f8c8d;
-                text-transform: uppercase;
-            }}
-            .back-btn {{
-                display: inline-block;
-                background: #3498db;
-                color: white;
-                text-decoration: none;
-                padding: 12px 24px;
-                border-radius: 5px;
-                margin-top: 20px;
-                font-weight: bold;
-                transition: background-color 0.3s;
-            }}
-            .back-btn:hover {{
-                background: #2980b9;
-            }}
-            .actions {{
-                display: flex;
-                justify-content: space-between;
-                margin-top: 30px;
-            }}
-            .delete-btn {{
-                background: #e74c3c;
-            }}
-            .delete-btn:hover {{
-                background: #c0392b;
-            }}
-        </style>
-        <script>
-            // Auto refresh the page every 30 seconds to show new hikes
-            setTimeout(function() {{
-                window.location.reload();
-            }}, 30000);
-        </script>
+        <link rel="stylesheet" href="{7}">
+        <script src="{8}" defer></script>
     </head>
-    <body>
+    <body data-session-id="{0}">
         <div class="container">
             <h1>Hike Details</h1>
 
@@ -679,7 +678,9 @@ def view_session(id):
         session_data[2],  # 3: Steps
         session_data[1],  # 4: Distance in km
         session_data[3],  # 5: Calories
-        session_data[0]  # 6: ID for delete link
+        session_data[0],  # 6: ID for delete link
+        static_assets.url('session.css'),  # 7: Stylesheet
+        static_assets.url('session.js')  # 8: Script
     )
 
     return html
@@ -688,6 +689,8 @@ def view_session(id):
 @app.route('/delete_session/<id>')
 def delete_session(id):
     hdb.delete(int(id))
+    track_cache.discard(id)
+    publish_changes(deleted=[id])
     return redirect(url_for('home'))
 
 
@@ -697,34 +700,45 @@ def add_session():
     steps = int(request.form.get('steps', 0))
     kcal = int(request.form.get('kcal', 0))
 
-    new_session = hike.HikeSession()
-
-    new_session.km = km
-    new_session.steps = steps
-    new_session.kcal = kcal
-
-    hdb.save(new_session)
+    session = hike.HikeSession(km=km, steps=steps, kcal=kcal)
+    hdb.save(session)
+    publish_changes(added=hike.SessionBatch([session]))
 
     return redirect(url_for('home'))
 
 
 @app.route('/bluetooth/status')
 def bt_status():
-    """API endpoint to get the status of the Bluetooth thread"""
+    """API endpoint to get the status of the Bluetooth thread, and the throughput and last sync time of every watch"""
     return jsonify({
         "active": bt_thread_running,
+        "ingesting": ingest_lock.held,
+        "connected": watch_manager.connected,
+        "devices": watch_manager.status(),
+        "ingest": watch_manager.pipeline.stats(),
+        "journal": watch_manager.journal.stats() if watch_manager.journal else None,
     })
 
 
+@app.route('/db/status')
+def db_status():
+    """API endpoint to get the lock, busy and read wait times, cache and maintenance counters of the database"""
+    return jsonify({**hdb.stats(), "maintenance": maintenance_scheduler.stats()})
+
+
 if __name__ == "__main__":
+    # Development server, see `serve.py` for production.
     # Start the Bluetooth thread before the Flask server for async automatic connection
-    bt_thread = threading.Thread(target=bluetooth_thread)
-    bt_thread.daemon = True
-    bt_thread.start()
+    follow_stop = threading.Event()
+    if ingest_lock.acquire(blocking=False):
+        start_ingest()
+    else:
+        print("Another process is receiving the sessions, only serving the web app.")
+    threading.Thread(target=follow_changes, args=(follow_stop,), daemon=True).start()
 
     try:
         app.run('0.0.0.0', debug=True)
     finally:
-        bt_thread_running = False
-        bt_thread.join(timeout=5)
+        follow_stop.set()
+        shutdown()
         print("Flask server shut down. Bluetooth thread should be terminated.")
\ No newline at end of file